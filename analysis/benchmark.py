@@ -0,0 +1,330 @@
+'''
+Benchmarks the analysis hot paths on synthetic read count tables, and checks that
+they give the same output as the reference (original pandas) implementations
+kept at the bottom of this file.
+
+run with:
+python benchmark.py [--library-size N] [--reads-per-sample N] [--skew S]
+
+The synthetic count tables are made like the real ones: a library of variants of
+the TRAF6 template (NNK codons around the fixed ...P.E... positions, as in
+`SORTING_TASKS` of ../data/src/count_sequences.py) is given Zipf-like
+abundances (the variant of rank r has a weight of 1 / r ** skew), a small
+fraction of the variants are binders that enrich every day while the rest are
+depleted, and the reads of each sample (MACSlib and days 1-5) are drawn from the
+resulting frequencies. Some reads get a mutation in the static last 4 nt or in
+the variable region (mismatch_rate), so that collapse_counts has duplicates to
+collapse and there are variants with stop codons to filter out.
+
+Timed:
+    - traf_pepseq_tools.load_and_merge_data
+    - traf_pepseq_tools.collapse_counts
+    - the s04 `driver` (filtering a merged enrichment table to a binder list)
+
+The peak memory of each benchmark (the largest amount of memory allocated by python
+and numpy/pandas during the call, measured with tracemalloc in a separate untimed
+run) is reported too. Use --library-size and --reads-per-sample to check how they
+scale to larger libraries.
+
+The timings, the checks and the configuration are saved as JSON in the results
+directory ([results directory]/[commit]_analysis.json), and `--compare` prints
+the timings of every saved result side by side.
+'''
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from Bio import Seq
+
+import src.traf_pepseq_tools as traf_tools
+import s04_binder_processing as s04
+
+TEMPLATE = '*********CCT***GAA*********CCGG'
+VARIABLE_REGION_TOKEN = '*'
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+SAMPLES = ['barcode_20', 'barcode_0', 'barcode_1', 'barcode_2', 'barcode_3', 'barcode_4']
+SAMPLE_NAMES = {
+    'barcode_20': 'pre-enrichment (MACSlib)',
+    'barcode_0': 'day_1',
+    'barcode_1': 'day_2',
+    'barcode_2': 'day_3',
+    'barcode_3': 'day_4',
+    'barcode_4': 'day_5',
+}
+COUNT_COLUMNS = ['pre-enrichment (MACSlib)', 'day_1', 'day_2', 'day_3', 'day_4', 'day_5']
+RESULTS_DIRECTORY = './benchmark_results'
+
+
+def synthetic_library(library_size, rng):
+    '''
+    returns a uint8 array with one row for each of `library_size` distinct variants of
+    `TEMPLATE` with NNK codons
+    '''
+    template = np.frombuffer(TEMPLATE.encode(), dtype=np.uint8)
+    variable = np.flatnonzero(template == ord(VARIABLE_REGION_TOKEN))
+    library = np.empty((0, len(template)), dtype=np.uint8)
+    while len(library) < library_size:
+        variants = np.tile(template, (library_size, 1))
+        variants[:, variable] = rng.choice(BASES, size=(library_size, len(variable)))
+        # third base of each codon is G or T
+        third = variable[variable % 3 == 2]
+        variants[:, third] = rng.choice(BASES[[2, 3]], size=(library_size, len(third)))
+        library = np.unique(np.concatenate([library, variants]), axis=0)
+    return library[rng.permutation(len(library))[:library_size]]
+
+
+def mutate(reads, rate, rng):
+    '''replace each base of each read (a uint8 array) with a random base with probability `rate`'''
+    mask = rng.random(reads.shape) < rate
+    reads[mask] = rng.choice(BASES, size=mask.sum())
+    return reads
+
+
+def synthetic_count_tables(
+    library_size=20000, reads_per_sample=500000, skew=1.0, binder_fraction=0.01, mismatch_rate=0.002, seed=0
+):
+    '''
+    returns a dictionary of synthetic count tables by barcode name. Each table is a
+    DataFrame with the `count` and `seq` of every sequence that was drawn at least once
+    '''
+    rng = np.random.default_rng(seed)
+    library = synthetic_library(library_size, rng)
+    weights = 1.0 / np.arange(1, library_size + 1) ** skew
+    # binders roughly double in frequency every day, everything else is slowly lost
+    growth = np.where(rng.random(library_size) < binder_fraction, 2.0, 0.7)
+    tables = {}
+    for day, barcode in enumerate(SAMPLES):
+        p = weights * growth ** day
+        draws = rng.choice(library_size, size=reads_per_sample, p=p / p.sum())
+        reads = mutate(library[draws], mismatch_rate, rng)
+        seqs, counts = np.unique(reads.view(f'S{reads.shape[1]}').ravel(), return_counts=True)
+        table = pd.DataFrame({'count': counts, 'seq': seqs.astype(str)})
+        tables[barcode] = table.sort_values('count', ascending=False, kind='mergesort')
+    return tables
+
+
+def write_count_tables(tables, directory):
+    '''writes the tables in the format of the `sequence_counts` files and returns their paths'''
+    files = []
+    for barcode, table in tables.items():
+        path = os.path.join(directory, f'{barcode}_f_nts_only')
+        with open(path, 'w') as handle:
+            for count, seq in zip(table['count'], table['seq']):
+                handle.write(f'{count}\t{count}\t{seq}\n')
+        files.append(path)
+    return files
+
+
+def timed(function, repeat):
+    '''returns (best time in seconds, return value of the last call) of calling `function` `repeat` times'''
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def peak_memory(function):
+    '''returns the peak memory (MB) allocated while calling `function` once, measured with tracemalloc'''
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+def same_table(df1, df2, sort_by):
+    '''True if two tables have the same columns and values (ignoring row order and int/float dtypes)'''
+    if sorted(df1.columns) != sorted(df2.columns):
+        return False
+    a = df1[sorted(df1.columns)].sort_values(sort_by).reset_index(drop=True)
+    b = df2[sorted(df2.columns)].sort_values(sort_by).reset_index(drop=True)
+    try:
+        pd.testing.assert_frame_equal(a, b, check_dtype=False)
+    except AssertionError:
+        return False
+    return True
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    tables = synthetic_count_tables(
+        library_size=args.library_size,
+        reads_per_sample=args.reads_per_sample,
+        skew=args.skew,
+        binder_fraction=args.binder_fraction,
+        mismatch_rate=args.mismatch_rate,
+        seed=args.seed,
+    )
+    results = {}
+    checks = {}
+
+    def record(name, seconds, rows, function):
+        peak_mb = peak_memory(function)
+        results[name] = {'seconds': seconds, 'rows': rows, 'peak_mb': peak_mb}
+        print(f'{name:<30} {seconds:>10.3f} s {rows:>10} rows {peak_mb:>10.1f} MB peak')
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_list = write_count_tables(tables, directory)
+
+        load = lambda: traf_tools.load_and_merge_data(file_list)
+        seconds, (R, barcode_cols) = timed(load, args.repeat)
+        record('load_and_merge_data', seconds, len(R), load)
+        _, (R_ref, barcode_cols_ref) = timed(lambda: reference_load_and_merge_data(file_list), 1)
+        checks['load_and_merge_data'] = barcode_cols == barcode_cols_ref and same_table(R, R_ref, 'seq')
+
+        R = R_ref.rename(columns=SAMPLE_NAMES)
+        collapse = lambda: traf_tools.collapse_counts(R, COUNT_COLUMNS)
+        seconds, collapsed = timed(collapse, args.repeat)
+        record('collapse_counts', seconds, len(collapsed), collapse)
+        collapsed_ref = reference_collapse_counts(R, COUNT_COLUMNS)
+        checks['collapse_counts'] = same_table(collapsed, collapsed_ref, 'seq')
+
+        table_file = os.path.join(directory, 'enrichment_readcounts.csv')
+        R[['seq'] + COUNT_COLUMNS].to_csv(table_file, index=False)
+        filters = {'initial_count_cutoff': 50, 'mask_count_cutoff': 20, 'day45_cutoff': 20, 'enrichment_cutoff': 2}
+        driver = lambda: s04.driver(table_file, COUNT_COLUMNS, **filters)
+        seconds, binders = timed(driver, args.repeat)
+        record('s04 driver', seconds, len(binders), driver)
+        checks['s04 driver'] = sorted(binders) == sorted(reference_driver(table_file, COUNT_COLUMNS, **filters))
+
+    for name, ok in sorted(checks.items()):
+        print(f'check {name:<30} {"OK" if ok else "DIFFERENT"}')
+
+    return {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': vars(args),
+        'results': results,
+        'checks': checks,
+    }
+
+
+def compare(results_directory):
+    '''prints the time and peak memory of each benchmark for every saved result'''
+    saved = []
+    for path in glob.glob(os.path.join(results_directory, '*_analysis.json')):
+        with open(path) as f:
+            saved.append(json.load(f))
+    saved.sort(key=lambda result: result['date'])
+    names = sorted(set(name for result in saved for name in result['results']))
+    for key, label, precision in [('seconds', 'seconds', 3), ('peak_mb', 'peak MB', 1)]:
+        print(f'{label:<30}' + ''.join(f'{result["commit"]:>14}' for result in saved))
+        for name in names:
+            row = [result['results'].get(name, {}).get(key) for result in saved]
+            print(f'{name:<30}' + ''.join(f'{"-" if x is None else f"{x:.{precision}f}":>14}' for x in row))
+
+
+# ==============================================================================
+# // reference implementations
+# ==============================================================================
+# frozen copies of the original pandas implementations. The functions that are
+# benchmarked above must give the same output as these.
+
+def reference_trans_string(s):
+    l = int(len(s)/3)*3
+    return str(Seq.Seq(s[0:l]).translate())
+
+
+def reference_load_and_merge_data(file_list):
+    R = pd.DataFrame(columns=["seq"])
+    for f in file_list:
+        df1 = traf_tools.df_import_1(f)
+        R = pd.merge(R, df1, on="seq", how="outer")
+    R = R.fillna(0)
+    barcode_cols = [col for col in R.columns]
+    barcode_cols.sort()
+    barcode_cols.remove("seq")
+    R = R[["seq"] + barcode_cols]
+    return R, barcode_cols
+
+
+def reference_collapse_counts(df1, cols):
+    df = df1.copy()
+    df['seq'] = df.seq.str[:-4]
+    df = df.groupby('seq')[cols].sum()
+    df = df.reset_index()
+    df['AA_seq'] = df['seq'].apply(reference_trans_string)
+    df = df.sort_values(cols, ascending=False)
+    return df
+
+
+def reference_filter_nonsense_seqs(df1):
+    df = df1.copy()
+    df = df[~df.AA_seq.str.contains(r"[\*X]")]
+    df = df[df.AA_seq.str.contains(r"...P.E...")]
+    return df
+
+
+def reference_driver(file, cols, initial_count_cutoff=50, mask_count_cutoff=20, day45_cutoff=20, enrichment_cutoff=2):
+    c = pd.read_csv(file)
+    c = reference_collapse_counts(c, cols)
+    c = reference_filter_nonsense_seqs(c)
+    c = c[(c[cols] >= initial_count_cutoff).any(axis=1)]
+    c = c.sort_values('seq')
+    c = c[['seq', 'AA_seq'] + cols]
+    f = c.copy()
+    T = c[cols].sum()
+    for i in cols:
+        f[i] = c[i]/T[i]
+    c = c.drop("pre-enrichment (MACSlib)", axis=1)
+    f = f.drop("pre-enrichment (MACSlib)", axis=1)
+    days1_5 = [x for x in c.columns if 'day' in x]
+    f[days1_5] = f[days1_5].mask(c[days1_5] < mask_count_cutoff, 0)
+    dcols = sorted([i for i in f.columns if 'day' in i])
+    for i in range(len(dcols)-1):
+        f['difference: '+dcols[i]+' to '+dcols[i+1]] = f[dcols[i+1]] - f[dcols[i]]
+    f = f.drop(dcols, axis=1)
+    ddays = [x for x in f.columns if 'day' in x]
+    f['n days enriched'] = (f[ddays] > 0).sum(1)
+    c['n days enriched'] = c['seq'].map(f.set_index('seq')['n days enriched'])
+    c_binders = c[(c['day_4'] >= day45_cutoff) | (c['day_5'] >= day45_cutoff)]
+    c_binders_filtered = c_binders[c_binders['n days enriched'] >= enrichment_cutoff]
+    return list(c_binders_filtered['AA_seq'].unique())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmarks the analysis on synthetic count tables and checks it against the reference implementations')
+    parser.add_argument('--library-size', type=int, default=20000, help='number of distinct variants in the library')
+    parser.add_argument('--reads-per-sample', type=int, default=500000, help='number of reads drawn for each sample')
+    parser.add_argument('--skew', type=float, default=1.0, help='the variant of rank r has a weight of 1 / r ** skew')
+    parser.add_argument('--binder-fraction', type=float, default=0.01, help='fraction of the variants that enrich')
+    parser.add_argument('--mismatch-rate', type=float, default=0.002, help='probability that a base of a read is mutated')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--repeat', type=int, default=3, help='each benchmark is run this many times and the best time is kept')
+    parser.add_argument('--results', type=str, default=RESULTS_DIRECTORY, help='directory the results are saved in')
+    parser.add_argument('--compare', action='store_true', help='print the saved results side by side instead of running the benchmarks')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.results)
+    else:
+        if not os.path.exists(args.results):
+            os.mkdir(args.results)
+        result = run(args)
+        out_path = os.path.join(args.results, f'{result["commit"]}_analysis.json')
+        with open(out_path, 'w') as f:
+            json.dump(result, f, indent=4, sort_keys=True)
+        print(f'results saved to {out_path}')
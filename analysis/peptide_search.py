@@ -0,0 +1,110 @@
+"""
+builds an index of the library peptides and the final binders, and searches it for the peptides that
+are the most similar to query peptides (see `src/peptide_index.py`).
+
+python peptide_search.py build [--parameters ./parameters.json] [--output ../supplementary_data_files/peptide_index.npz]
+python peptide_search.py query PQRPTEIEW [more peptides] [--queries-file peptides.txt]
+    [--k 10 | --max-distance 2 | --min-score 30] [--matrix BLOSUM62] [--output results.csv]
+
+`build` indexes the AA sequences of the merged enrichment tables (collapsed with `collapse_counts`
+and filtered for nonsense sequences, without a read count cutoff) and of `final_binder_list.txt`,
+saves the index and adds its path to parameters.json (`peptide index`).
+`query` loads the index and finds the `--k` nearest peptides of each query (the default), or every
+peptide within `--max-distance` substitutions (Hamming distance) or with a `--matrix` score of at
+least `--min-score`. The queries can be given on the command line and/or in a file (one per line).
+"""
+import argparse
+import json
+import os
+import time
+
+import pandas as pd
+
+import src.traf_pepseq_tools as traf_tools
+from src.peptide_index import PeptideIndex
+import s02_filter_enrichment_tables as s02
+
+
+def library_peptides(table_files, cols):
+    """returns the AA sequences of the collapsed and filtered merged enrichment tables"""
+    peptides = []
+    for file in table_files:
+        table = s02.collapse_and_filter_nonsense(pd.read_csv(file), cols)
+        peptides.extend(table['AA_seq'].unique())
+    return peptides
+
+
+def build(parameter_file, output_file=None):
+    with open(parameter_file) as f:
+        params = json.load(f)
+    if output_file is None:
+        output_file = os.path.join(params['filepaths']['output directory'], 'peptide_index.npz')
+    peptides = library_peptides(params['filepaths']['merged enrichment tables'], params['enrichment count columns'])
+    binder_file = params['filepaths'].get('final binder list')
+    binders = traf_tools.seqfile2list(binder_file) if binder_file is not None and os.path.exists(binder_file) else []
+    index = PeptideIndex(peptides, binders=binders)
+    index.save(output_file)
+    print(f'{len(index)} peptides ({len(binders)} binders) indexed')
+    print('file saved to {}'.format(output_file))
+
+    # update parameter json file to include new files
+    params['filepaths']['peptide index'] = output_file
+    with open(parameter_file, 'w') as f:
+        json.dump(params, f, indent=4)
+    return index
+
+
+def query(index_file, queries, k=10, max_distance=None, min_score=None, matrix=None):
+    index = PeptideIndex.load(index_file)
+    start = time.time()
+    if max_distance is not None or min_score is not None:
+        results = index.radius(queries, max_distance=max_distance, min_score=min_score, matrix=matrix)
+    else:
+        results = index.knn(queries, k=k, matrix=matrix)
+    print(f'{len(queries)} queries against {len(index)} peptides in {time.time() - start:.3f} s')
+    return results
+
+
+def index_file_from_parameters(parameter_file):
+    with open(parameter_file) as f:
+        params = json.load(f)
+    if 'peptide index' in params['filepaths']:
+        return params['filepaths']['peptide index']
+    return os.path.join(params['filepaths']['output directory'], 'peptide_index.npz')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='peptide similarity search over the library peptides and the final binders')
+    parser.add_argument('--parameters', type=str, default='./parameters.json', help='the parameters file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='build the index')
+    build_parser.add_argument('--output', type=str, default=None,
+                              help='the index file (default: peptide_index.npz in the output directory)')
+    query_parser = subparsers.add_parser('query', help='search the index')
+    query_parser.add_argument('queries', nargs='*', help='query peptides')
+    query_parser.add_argument('--queries-file', type=str, default=None, help='a file with one query peptide per line')
+    query_parser.add_argument('--index', type=str, default=None,
+                              help='the index file (default: `peptide index` in the parameters file)')
+    query_parser.add_argument('--k', type=int, default=10, help='number of nearest peptides of each query')
+    query_parser.add_argument('--max-distance', type=int, default=None,
+                              help='return every peptide within this Hamming distance instead of the k nearest')
+    query_parser.add_argument('--min-score', type=int, default=None,
+                              help='return every peptide with at least this --matrix score instead of the k nearest')
+    query_parser.add_argument('--matrix', type=str, default=None,
+                              help='substitution matrix (ex: BLOSUM62), by default the Hamming distance is used')
+    query_parser.add_argument('--output', type=str, default=None, help='save the results to this csv file')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.parameters, args.output)
+    else:
+        queries = list(args.queries)
+        if args.queries_file is not None:
+            queries.extend(traf_tools.seqfile2list(args.queries_file))
+        index_file = args.index if args.index is not None else index_file_from_parameters(args.parameters)
+        results = query(index_file, queries, k=args.k, max_distance=args.max_distance, min_score=args.min_score, matrix=args.matrix)
+        if args.output is not None:
+            results.to_csv(args.output, index=False)
+            print('file saved to {}'.format(args.output))
+        else:
+            print(results.to_string(index=False))
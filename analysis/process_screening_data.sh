@@ -1,9 +1,6 @@
-
-
-python s01_compile_enrichment_tables.py
-python s02_filter_enrichment_tables.py
-python s03_nonbinder_processing.py
-python s04_binder_processing.py
-
-
-
+python run_pipeline.py
+# runs the same steps as:
+# python s01_compile_enrichment_tables.py
+# python s02_filter_enrichment_tables.py
+# python s03_nonbinder_processing.py
+# python s04_binder_processing.py
@@ -0,0 +1,155 @@
+"""
+runs the steps of s01-s04 in a single python process and keeps the tables in memory between them,
+instead of having each script read the csv files that the previous one wrote.
+Each read count file is loaded once, and each experiment (replicate) is collapsed and filtered for
+nonsense sequences once. The read count cutoffs of s02 (`readcount cutoff`) and s04
+(`initial_count_cutoff`) are then both applied to that table.
+
+python run_pipeline.py [--parameters ./parameters.json] [--no-files]
+
+By default it writes the same files as running the 4 scripts (`process_screening_data.sh`) and
+adds their paths to the parameters file. With `--no-files` nothing is written (`run_pipeline` returns
+the tables if it's used from python).
+"""
+import argparse
+import json
+import os
+
+import src.traf_pepseq_tools as traf_tools
+import s01_compile_enrichment_tables as s01
+import s02_filter_enrichment_tables as s02
+import s03_nonbinder_processing as s03
+import s04_binder_processing as s04
+
+
+def process_replicate(
+    barcode_list, count_file_dir, sample_renaming_key, cols, count_cutoff, initial_count_cutoff,
+    output_file=None, processed_file=None, error_correction=None,
+):
+    '''
+    the s01 and s02 steps of one experiment (replicate). Returns the merged table, the table processed
+    with `count_cutoff` (s02) and the one filtered with `initial_count_cutoff` (the input of s04). The
+    first two are saved to `output_file` and `processed_file` if they are given
+    '''
+    # s01
+    R = s01.compile_enrichment_table(barcode_list, count_file_dir, sample_renaming_key, error_correction=error_correction)
+    # s02 and s04 start from the same collapsed table with different read count cutoffs
+    collapsed = s02.collapse_and_filter_nonsense(R, cols)
+    processed = s02.apply_count_cutoff(collapsed, count_cutoff, cols)
+    filtered = s02.apply_count_cutoff(collapsed, initial_count_cutoff, cols)
+    if output_file is not None:
+        s01.write_enrichment_table(R, output_file)
+    if processed_file is not None:
+        s01.write_enrichment_table(processed, processed_file)
+    return R, processed, filtered
+
+
+def run_pipeline(params, write_files=True):
+    """runs s01-s04 with the parameters in the dictionary `params` (the contents of parameters.json)
+
+    Parameters
+    ----------
+    params : dict
+        the parameters (see parameters.json). If `write_files` is True, the paths of the files
+        that are written are added to `params['filepaths']` like the scripts do
+    write_files : bool, optional
+        write the csv files and the final binder list to the `output directory`, by default True
+
+    Returns
+    -------
+    dict
+        `merged enrichment tables` and `processed merged enrichment tables`: dictionaries of the
+        tables of each experiment, `processed nonbinder table`: the nonbinder table and
+        `final binder list`: the list of binder AA sequences
+    """
+    count_file_dir = params["filepaths"]["sequence counts directory"]
+    sample_renaming_key = params["barcode name key"]
+    output_folder = params["filepaths"]["output directory"]
+    cols = params["enrichment count columns"]
+    count_cutoff = params["readcount cutoff"]
+    readcount_filters = params["final binder readcount filters"]
+    error_correction = params.get("error correction")
+    if write_files and not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    experiments = list(params["experiment barcode lists"].keys())
+    table_files = [os.path.join(output_folder, exp + "_readcounts.csv") for exp in experiments]
+    processed_files = [
+        '{}-processed{}'.format(*os.path.splitext(output_file)) for output_file in table_files
+    ]
+    jobs = [
+        (
+            params["experiment barcode lists"][exp], count_file_dir, sample_renaming_key, cols,
+            count_cutoff, readcount_filters["initial_count_cutoff"],
+            output_file if write_files else None, processed_file if write_files else None,
+            error_correction,
+        )
+        for exp, output_file, processed_file in zip(experiments, table_files, processed_files)
+    ]
+    # the replicates are independent until s04, so they're processed in `replicate processes` processes
+    results = traf_tools.map_replicates(process_replicate, jobs, traf_tools.replicate_processes(params))
+    merged_tables = {exp: R for exp, (R, _, _) in zip(experiments, results)}
+    processed_tables = {exp: processed for exp, (_, processed, _) in zip(experiments, results)}
+    filtered_tables = [filtered for _, _, filtered in results]
+    if write_files:
+        for output_file, processed_file in zip(table_files, processed_files):
+            print('file saved to {}'.format(output_file))
+            print('file saved to {}'.format(processed_file))
+
+    # s03
+    nbdf = traf_tools.error_corrected_table(
+        traf_tools.df_import_1(params['filepaths']['nonbinder sequence counts file']), error_correction
+    )
+    nb_df_20rcc = s03.filter_rename_single_column_table(nbdf, count_cutoff=20, col='barcode_5')
+    print('number of sequences with >=20 reads: ', len(nb_df_20rcc['AA_seq'].unique()))
+
+    # s04 (all replicates at once)
+    binders = s04.find_binders(
+        filtered_tables,
+        cols,
+        mask_count_cutoff=readcount_filters["mask_count_cutoff"],
+        day45_cutoff=readcount_filters["day45_cutoff"],
+        enrichment_cutoff=readcount_filters["enrichment_cutoff"],
+    )
+    final_binders = traf_tools.union_2_lists(binders[0], binders[1])
+    print(f'number of unique seqs with >=20 reads on day 4 or 5 and that enriched at least 2 of the 4 rounds: {len(final_binders)}')
+
+    if write_files:
+        nonbinder_file = os.path.join(output_folder, 'nonbinder_readcounts-processed.csv')
+        nb_df_20rcc.to_csv(nonbinder_file, index=False)
+        print('file saved to {}'.format(nonbinder_file))
+        binder_file = os.path.join(output_folder, 'final_binder_list.txt')
+        traf_tools.write_seqlist(final_binders, binder_file)
+        print('file saved to {}'.format(binder_file))
+        params['filepaths']['merged enrichment tables'] = table_files
+        params['filepaths']['processed merged enrichment tables'] = processed_files
+        params['filepaths']['processed nonbinder table'] = nonbinder_file
+        params['filepaths']['final binder list'] = binder_file
+
+    return {
+        'merged enrichment tables': merged_tables,
+        'processed merged enrichment tables': processed_tables,
+        'processed nonbinder table': nb_df_20rcc,
+        'final binder list': final_binders,
+    }
+
+
+def main(parameter_file, write_files=True):
+    with open(parameter_file) as f:
+        params = json.load(f)
+    results = run_pipeline(params, write_files=write_files)
+    if write_files:
+        # update parameter json file to include new files
+        with open(parameter_file, 'w') as f:
+            json.dump(params, f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='runs s01-s04 in one process without reading back intermediate csv files')
+    parser.add_argument('--parameters', type=str, default='./parameters.json',
+                        help='the parameters file (default: ./parameters.json)')
+    parser.add_argument('--no-files', action='store_true',
+                        help="don't write any files (only print the summary)")
+    args = parser.parse_args()
+    main(args.parameters, write_files=not args.no_files)
@@ -15,22 +15,51 @@ def get_experiment_filelist(count_file_dir, barcode_list):
 
 
 def col_rename_and_sort(df1, sample_renaming_key):
-    df = df1.copy()
-    df = df.rename(columns=sample_renaming_key)
-    df = df[sorted(df.columns)]
-    return df
+    # the renamed frame shares the data of `df1`, only the column selection copies it
+    df = df1.rename(columns=sample_renaming_key, copy=False)
+    return df[sorted(df.columns)]
 
 
 def enrichment_merge(
-    barcode_list, count_file_dir, sample_renaming_key
+    barcode_list, count_file_dir, sample_renaming_key, error_correction=None
 ):
     # ===== LOAD AND MERGE DATA
     file_list = get_experiment_filelist(count_file_dir, barcode_list)
-    R, _ = traf_tools.load_and_merge_data(file_list)
+    R, _ = traf_tools.load_and_merge_data(file_list, error_correction=error_correction)
 
     # ===== RENAME COLUMNS to names that are more meaningful using `sample renaming key`
     R = col_rename_and_sort(R, sample_renaming_key=sample_renaming_key)
-    return R.sort_values('seq').reset_index(drop=True)
+    return R.sort_values('seq', ignore_index=True)
+
+
+def compile_enrichment_table(barcode_list, count_file_dir, sample_renaming_key, error_correction=None):
+    '''
+    returns the merged read count table of one experiment, as it is saved to `[experiment]_readcounts.csv`
+    (`error_correction`: the `error correction` parameters, see `traf_tools.error_corrected_table`)
+    '''
+    R=enrichment_merge(
+        barcode_list, count_file_dir, sample_renaming_key, error_correction=error_correction
+    )
+    R=R[['seq','pre-enrichment (MACSlib)','day_1','day_2','day_3','day_4','day_5']]
+    return R
+
+
+def write_enrichment_table(R, output_file):
+    '''
+    `load_and_merge_data` returns integer counts (`COUNT_DTYPE`). The enrichment tables are saved with
+    float counts (ex: `20.0`) like the ones the outer merges used to produce
+    '''
+    count_cols = [col for col in R.columns if col not in ('seq', 'AA_seq')]
+    R.astype({col: float for col in count_cols}).to_csv(output_file, index=False)
+
+
+def compile_and_write_enrichment_table(barcode_list, count_file_dir, sample_renaming_key, output_file, error_correction=None):
+    '''compiles the table of one experiment and saves it to `output_file` (one replicate of `main`)'''
+    R=compile_enrichment_table(
+        barcode_list, count_file_dir, sample_renaming_key, error_correction=error_correction
+    )
+    write_enrichment_table(R, output_file)
+    return output_file
 
 
 def main(parameter_file):
@@ -41,6 +70,7 @@ def main(parameter_file):
     # extract arguments from parameters.json file
     count_file_dir = params["filepaths"]["sequence counts directory"]
     sample_renaming_key = params["barcode name key"]
+    error_correction = params.get("error correction")
     experiments = list(params["experiment barcode lists"].keys())
 
     # output file directory
@@ -49,16 +79,15 @@ def main(parameter_file):
         os.mkdir(output_folder)
 
     # merge barcodes for each experiment and export to a csv file
-    table_files=[]
-    for exp in experiments:
-        barcode_list = params["experiment barcode lists"][exp]
-        R=enrichment_merge(
-            barcode_list, count_file_dir, sample_renaming_key
-        )
-        R=R[['seq','pre-enrichment (MACSlib)','day_1','day_2','day_3','day_4','day_5']]
-        output_file = os.path.join(output_folder, exp + "_readcounts.csv")
-        table_files.append(output_file)
-        R.to_csv(output_file, index=False)
+    # (the experiments are independent, so they're processed in `replicate processes` processes)
+    table_files=[os.path.join(output_folder, exp + "_readcounts.csv") for exp in experiments]
+    jobs = [
+        (params["experiment barcode lists"][exp], count_file_dir, sample_renaming_key, output_file, error_correction)
+        for exp, output_file in zip(experiments, table_files)
+    ]
+    for output_file in traf_tools.map_replicates(
+        compile_and_write_enrichment_table, jobs, traf_tools.replicate_processes(params)
+    ):
         print('file saved to {}'.format(output_file))
 
     # update parameter json file to include new files
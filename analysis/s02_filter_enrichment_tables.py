@@ -6,16 +6,34 @@ import pandas as pd
 import src.traf_pepseq_tools as traf_tools
 
 
-def filter_across_multiple_columns(df1, count_cutoff, cols):
-    df = df1.copy()
-    df = traf_tools.collapse_counts(df, cols)
+def collapse_and_filter_nonsense(df1, cols):
+    '''collapses the read counts and removes the nonsense sequences (the read count cutoff is applied separately by `apply_count_cutoff`)'''
+    df = traf_tools.collapse_counts(df1, cols, translate=False)
     df = traf_tools.filter_nonsense_seqs(df)
-    df = df[(df[cols] >= count_cutoff).any(1)]
+    return df
+
+
+def apply_count_cutoff(df1, count_cutoff, cols):
+    '''keeps the sequences with >= `count_cutoff` reads in any of `cols`, sorted by `seq`'''
+    df = df1[(df1[cols] >= count_cutoff).any(1)]
     df = df.sort_values('seq')
     df = df[['seq','AA_seq']+cols]
     return df
 
 
+def filter_across_multiple_columns(df1, count_cutoff, cols):
+    df = collapse_and_filter_nonsense(df1, cols)
+    return apply_count_cutoff(df, count_cutoff, cols)
+
+
+def filter_table_file(file, output_file, count_cutoff, cols):
+    '''filters the merged enrichment table in `file` and saves it to `output_file` (one replicate of `main`)'''
+    table = pd.read_csv(file)
+    table = filter_across_multiple_columns(table, count_cutoff, cols)
+    table.to_csv(output_file, index=False)
+    return output_file
+
+
 def main(parameter_file):
     # open parameters.json file
     with open(parameter_file) as f:
@@ -29,11 +47,9 @@ def main(parameter_file):
 
     for file in table_files:
         exp, ext = os.path.splitext(file)
-        output_file = f'{exp}-processed{ext}'
-        new_files.append(output_file)
-        table = pd.read_csv(file)
-        table = filter_across_multiple_columns(table, count_cutoff, cols)
-        table.to_csv(output_file, index=False)
+        new_files.append(f'{exp}-processed{ext}')
+    jobs = [(file, output_file, count_cutoff, cols) for file, output_file in zip(table_files, new_files)]
+    for output_file in traf_tools.map_replicates(filter_table_file, jobs, traf_tools.replicate_processes(params)):
         print('file saved to {}'.format(output_file))
 
     # update parameter json file to include new files
@@ -6,8 +6,7 @@ import src.traf_pepseq_tools as traf_tools
 
 
 def filter_rename_single_column_table(df1, count_cutoff=0, col='barcode_5'):
-    df = df1.copy()
-    df = traf_tools.collapse_counts(df, col)
+    df = traf_tools.collapse_counts(df1, col, translate=False)
     df = traf_tools.filter_nonsense_seqs(df)
     df = df[df[col]>=count_cutoff]
     df = df.sort_values(col, ascending=False)
@@ -22,7 +21,9 @@ def main(parameter_file,save2file=False):
         params = json.load(f)
 
     non_binder_counts_file = params['filepaths']['nonbinder sequence counts file']
-    nbdf = traf_tools.df_import_1(non_binder_counts_file)
+    nbdf = traf_tools.error_corrected_table(
+        traf_tools.df_import_1(non_binder_counts_file), params.get('error correction')
+    )
 
     nb_df_20rcc = filter_rename_single_column_table(nbdf, count_cutoff=20, col='barcode_5')
 
@@ -1,5 +1,6 @@
 import os
 import sys
+import numpy as np
 import pandas as pd
 
 import json
@@ -8,19 +9,13 @@ import src.traf_pepseq_tools as traf_tools
 
 def calc_read_fraction(c, cols):
     '''calculate readfraction for each day'''
-    # I probably don't need to make all of these dataframe copies but I'm not really running out of memory
-    #or running into bottlenecks
-    counts = c.copy()
-    T = counts[cols].sum()
-    f = counts.copy()
-    for i in cols:
-        f[i] = counts[i]/T[i]
-    return f
+    # a single copy of `c` with the read fractions in place of the counts
+    T = c[cols].sum()
+    return c.assign(**{i: c[i]/T[i] for i in cols})
 
 
 def filter_across_multiple_columns(df1, count_cutoff, cols):
-    df = df1.copy()
-    df = traf_tools.collapse_counts(df, cols)
+    df = traf_tools.collapse_counts(df1, cols, translate=False)
     df = traf_tools.filter_nonsense_seqs(df)
     df = df[(df[cols] >= count_cutoff).any(1)]
     df = df.sort_values('seq')
@@ -39,33 +34,29 @@ def fold_change_single_day(df, col_i, col_f):
 def calc_daily_change(df, how = 'fold change'):
     '''calculate the change in column values over each day
     return a dataframe with deltas'''
-    # deltas = pd.DataFrame(index=dat['AA_seq'])
-    # deltas = dat.copy()
-    dat = df.copy()
-    dcols = sorted([i for i in dat.columns if 'day' in i])
+    # the changes are calculated from `df` and added to a copy without the day columns
+    dcols = sorted([i for i in df.columns if 'day' in i])
+    dat = df.drop(dcols, axis=1)
     for i in range(len(dcols)-1):
         init = dcols[i]
         fin = dcols[i+1]
         if how == 'fold change':
-            dat['fold change: '+init+' to '+fin] = fold_change_single_day(dat, init, fin)
+            dat['fold change: '+init+' to '+fin] = fold_change_single_day(df, init, fin)
         if how == 'difference':
-            dat['difference: '+init+' to '+fin] = diff_single_day(dat, init, fin)
-    dat=dat.drop(dcols, axis=1)
+            dat['difference: '+init+' to '+fin] = diff_single_day(df, init, fin)
     return dat
 
 
 def df2unique_seq_list(df):
     '''returns list of the unique strings in `df['AA_seq']`'''
-    df1 = df.copy()
-    seq_list = list(df1['AA_seq'].unique())
+    seq_list = list(df['AA_seq'].unique())
     return seq_list
 
 
 def mask_frequency_by_count_cutoff(freq_df, counts_df, cols, mask_count_cutoff=20, replacement_number=0):
     f = freq_df.copy()
-    c = counts_df.copy()
     # replace all of the entries with < mask_count_cutoff with `replacement_number`
-    f[cols]=f[cols].mask(c[cols]<mask_count_cutoff, replacement_number)
+    f[cols]=f[cols].mask(counts_df[cols]<mask_count_cutoff, replacement_number)
     return f
 
 
@@ -102,10 +93,9 @@ def get_binders_from_day4_5(freq_df, counts_df, mask_count_cutoff=20, day45_cuto
         filtered read count dataframe. Contains only AA sequences that have >= `day45_cutoff` reads on
         day 4 and/or 5 and enriched `enrichment_cutoff` or more times during the enrichment
     """    
-    c = counts_df.copy()
-    f = freq_df.copy()
-    c = c.drop("pre-enrichment (MACSlib)", axis=1)
-    f = f.drop("pre-enrichment (MACSlib)", axis=1)
+    # drop returns new frames, so `counts_df` and `freq_df` aren't modified
+    c = counts_df.drop("pre-enrichment (MACSlib)", axis=1)
+    f = freq_df.drop("pre-enrichment (MACSlib)", axis=1)
     days1_5 = [x for x in c.columns if 'day' in x]
     f = mask_frequency_by_count_cutoff(
         f,
@@ -126,13 +116,114 @@ def get_binders_from_day4_5(freq_df, counts_df, mask_count_cutoff=20, day45_cuto
     return c_binders_filtered
 
 
+# ==============================================================================
+# // enrichment engine
+# ==============================================================================
+# the same calculation as `calc_read_fraction` -> `get_binders_from_day4_5`, done on a
+# replicate x sample x sequence array of counts for all of the replicates at once
+
+
+def enrichment_tensor(tables, cols):
+    """stacks the read counts of filtered read count tables (one per replicate) into one array
+
+    Parameters
+    ----------
+    tables : list of DataFrame
+        read count tables that `filter_across_multiple_columns` was applied to
+    cols : list
+        the count columns (ex: ['pre-enrichment (MACSlib)', 'day_1', ...])
+
+    Returns
+    -------
+    seqs : ndarray
+        the sorted union of the `seq`s of all of the tables
+    aa_seqs : ndarray
+        the `AA_seq` of each of `seqs`
+    counts : ndarray
+        float array of shape (replicate, column, sequence) with the counts. The sequences
+        that aren't in a replicate's table have 0 counts
+    present : ndarray
+        boolean array of shape (replicate, sequence), True if the sequence is in the replicate's table
+    """
+    seqs, inverse = np.unique(
+        np.concatenate([table['seq'].to_numpy(dtype=object) for table in tables]), return_inverse=True
+    )
+    counts = np.zeros((len(tables), len(cols), len(seqs)), dtype=np.float64)
+    present = np.zeros((len(tables), len(seqs)), dtype=bool)
+    aa_seqs = np.empty(len(seqs), dtype=object)
+    start = 0
+    for r, table in enumerate(tables):
+        rows = inverse[start:start + len(table)]
+        start += len(table)
+        counts[r][:, rows] = table[cols].to_numpy(dtype=np.float64).T
+        present[r, rows] = True
+        aa_seqs[rows] = table['AA_seq'].to_numpy(dtype=object)
+    return seqs, aa_seqs, counts, present
+
+
+def days_enriched(counts, cols, mask_count_cutoff=20, how='difference'):
+    """returns an int array of shape (replicate, sequence) with the number of days each sequence of an
+    `enrichment_tensor` enriched (see `binder_mask`)"""
+    days = [cols.index(day) for day in sorted(col for col in cols if 'day' in col)]
+    day_counts = counts[:, days]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = day_counts / day_counts.sum(axis=2, keepdims=True)
+        fractions[day_counts < mask_count_cutoff] = 0
+        if how == 'fold change':
+            changes = fractions[:, 1:] / fractions[:, :-1]
+        else:
+            changes = fractions[:, 1:] - fractions[:, :-1]
+    return (changes > 0).sum(axis=1)
+
+
+def late_day_counts(counts, cols):
+    """returns the largest of the day 4 and day 5 counts of each sequence (replicate, sequence) of an `enrichment_tensor`"""
+    return counts[:, [cols.index('day_4'), cols.index('day_5')]].max(axis=1)
+
+
+def binder_mask(counts, present, cols, mask_count_cutoff=20, day45_cutoff=20, enrichment_cutoff=2, how='difference'):
+    """returns a boolean array of shape (replicate, sequence) of the binders in an `enrichment_tensor`
+
+    read fractions are calculated for each replicate and column, the fractions with < `mask_count_cutoff`
+    reads are set to 0, and the daily changes (`how` = 'difference' or 'fold change') are calculated
+    between consecutive days (the columns with 'day' in their name, in sorted order). A binder has
+    >= `day45_cutoff` reads on day 4 and/or day 5 and enriched (a change > 0) on >= `enrichment_cutoff`
+    days. See `get_binders_from_day4_5` for details.
+    """
+    n_days_enriched = days_enriched(counts, cols, mask_count_cutoff=mask_count_cutoff, how=how)
+    return present & (late_day_counts(counts, cols) >= day45_cutoff) & (n_days_enriched >= enrichment_cutoff)
+
+
+def find_binders(tables, cols, mask_count_cutoff=20, day45_cutoff=20, enrichment_cutoff=2):
+    '''returns a list of the binders (unique AA sequences, see `df2unique_seq_list`) of each filtered read count table in `tables`'''
+    seqs, aa_seqs, counts, present = enrichment_tensor(tables, cols)
+    mask = binder_mask(
+        counts,
+        present,
+        cols,
+        mask_count_cutoff=mask_count_cutoff,
+        day45_cutoff=day45_cutoff,
+        enrichment_cutoff=enrichment_cutoff,
+    )
+    # the tables are sorted by `seq` like `seqs`, so the binders are in the same order as in the tables
+    return [list(pd.unique(aa_seqs[replicate_mask])) for replicate_mask in mask]
+
+
 def driver(file, cols, initial_count_cutoff=50, mask_count_cutoff=20, day45_cutoff=20, enrichment_cutoff=2):
     print(f"filters used when processing {file}\n{initial_count_cutoff=}\n{mask_count_cutoff=}\n{day45_cutoff=}\n{enrichment_cutoff=}")
     c = pd.read_csv(file)
     c = filter_across_multiple_columns(c, initial_count_cutoff, cols)
-    f = calc_read_fraction(c, cols)
-    df = get_binders_from_day4_5(f, c, mask_count_cutoff=mask_count_cutoff, day45_cutoff=day45_cutoff, enrichment_cutoff=enrichment_cutoff)
-    return df2unique_seq_list(df)
+    return binders_from_filtered_table(c, cols, mask_count_cutoff=mask_count_cutoff, day45_cutoff=day45_cutoff, enrichment_cutoff=enrichment_cutoff)
+
+
+def binders_from_filtered_table(c, cols, mask_count_cutoff=20, day45_cutoff=20, enrichment_cutoff=2):
+    '''returns the list of binders (AA sequences) of a read count table that `filter_across_multiple_columns` was already applied to'''
+    return find_binders([c], cols, mask_count_cutoff=mask_count_cutoff, day45_cutoff=day45_cutoff, enrichment_cutoff=enrichment_cutoff)[0]
+
+
+def read_and_filter_table(file, count_cutoff, cols):
+    '''reads a merged enrichment table and applies `filter_across_multiple_columns` (one replicate of `main`)'''
+    return filter_across_multiple_columns(pd.read_csv(file), count_cutoff, cols)
 
 
 def main(parameter_file):
@@ -154,9 +245,17 @@ def main(parameter_file):
     readcount_filters=params["final binder readcount filters"]
 
 
-    binders = []
+    # all of the replicates go through the enrichment engine (`find_binders`) together
+    initial_count_cutoff = readcount_filters['initial_count_cutoff']
+    binder_filters = {key: value for key, value in readcount_filters.items() if key != 'initial_count_cutoff'}
     for file in table_files:
-        binders.append(driver(file, cols, **readcount_filters))
+        print(f"filters used when processing {file}\n{readcount_filters}")
+    tables = traf_tools.map_replicates(
+        read_and_filter_table,
+        [(file, initial_count_cutoff, cols) for file in table_files],
+        traf_tools.replicate_processes(params),
+    )
+    binders = find_binders(tables, cols, **binder_filters)
 
     final_binders = traf_tools.union_2_lists(binders[0],binders[1])
     traf_tools.write_seqlist(final_binders, output_file)
@@ -0,0 +1,286 @@
+"""
+similarity search over a set of peptides (the library sequences from `collapse_counts` and the final
+binder list), by Hamming distance or substitution matrix score (ex: BLOSUM62).
+
+The peptides are grouped by length, and the residues (`ALPHABET`) at each group of
+RESIDUES_PER_CODE positions are stored as one number (`position_codes`). For a query, the score of
+every possible code of a group is computed from the substitution matrix (`group_scores`), and its
+score against every peptide of its length is the sum of these scores indexed with the peptides'
+codes, so a query only touches `length` / RESIDUES_PER_CODE arrays of the size of the library
+instead of comparing strings. Queries are scored
+in blocks (`QUERY_BLOCK_SIZE` scores at a time), so thousands of queries are handled with the same
+array operations.
+Hamming distance is the identity matrix score subtracted from the length.
+Peptides are only compared with peptides of the same length.
+
+>>> index = PeptideIndex(library_peptides, binders=final_binders)
+>>> index.save('peptide_index.npz')
+>>> index = PeptideIndex.load('peptide_index.npz')
+>>> index.knn(['PQRPTEIEW'], k=10)                                  # 10 nearest by Hamming distance
+>>> index.radius(['PQRPTEIEW'], max_distance=2)                     # everything within 2 substitutions
+>>> index.knn(['PQRPTEIEW'], k=10, matrix='BLOSUM62')               # 10 highest BLOSUM62 scores
+>>> index.radius(['PQRPTEIEW'], min_score=30, matrix='BLOSUM62')
+"""
+import numpy as np
+import pandas as pd
+
+# residues of the index. Any other character is stored as X
+ALPHABET = "ACDEFGHIKLMNPQRSTVWY*X"
+RESIDUE_NUMBERS = np.full(256, ALPHABET.index("X"), dtype=np.uint8)
+RESIDUE_NUMBERS[np.frombuffer(ALPHABET.encode(), dtype=np.uint8)] = np.arange(len(ALPHABET), dtype=np.uint8)
+RESIDUE_NUMBERS[np.frombuffer(ALPHABET.lower().encode(), dtype=np.uint8)] = np.arange(len(ALPHABET), dtype=np.uint8)
+
+# number of query x peptide scores computed at the same time
+QUERY_BLOCK_SIZE = 2 ** 22
+# the residues of each peptide are stored in groups of RESIDUES_PER_CODE positions, each numbered
+# with a single code (< len(ALPHABET) ** RESIDUES_PER_CODE), see `position_codes`
+RESIDUES_PER_CODE = 3
+# the k nearest peptides are chosen among the peptides scoring at least the k-th highest score of
+# 1 / KTH_SCORE_SAMPLE of the peptides (see `kth_score_bounds`)
+KTH_SCORE_SAMPLE = 16
+
+
+def encode_peptides(peptides, length):
+    """returns the uint8 matrix of residue numbers (one row per peptide) of peptides of `length` residues"""
+    joined = "".join(peptides).encode("ascii", errors="replace")
+    return RESIDUE_NUMBERS[np.frombuffer(joined, dtype=np.uint8)].reshape(-1, length)
+
+
+def position_groups(length):
+    """returns the positions of each group of RESIDUES_PER_CODE residues of peptides of `length`"""
+    return [list(range(start, min(start + RESIDUES_PER_CODE, length))) for start in range(0, length, RESIDUES_PER_CODE)]
+
+
+def position_codes(residues, length):
+    """
+    returns the code of each group of positions (`position_groups`) of the rows of a residue matrix
+    (`encode_peptides`), as a uint16 matrix with one row per group and one column per peptide.
+    The first position of a group is the most significant digit (base len(ALPHABET))
+    """
+    codes = np.zeros((len(position_groups(length)), len(residues)), dtype=np.uint16)
+    for i, positions in enumerate(position_groups(length)):
+        for position in positions:
+            codes[i] = codes[i] * len(ALPHABET) + residues[:, position]
+    return codes
+
+
+def group_scores(table, residues, positions):
+    """
+    returns the score of every code of a group of positions (`position_codes`) for each row of a
+    residue matrix (the queries), as a matrix with one row per query and one column per code
+    """
+    scores = np.zeros((len(residues), 1), dtype=np.int16)
+    for position in positions:
+        scores = (scores[:, :, np.newaxis] + table[residues[:, position]][:, np.newaxis, :]).reshape(len(residues), -1)
+    return scores
+
+
+def kth_score_bounds(scores, k):
+    """
+    returns a lower bound of the `k`-th highest score of each row of `scores`: the `k`-th highest
+    score of the first 1 / KTH_SCORE_SAMPLE columns (or of all of them if there are few), which is
+    cheaper to find than the exact score and only keeps a few more candidates
+    """
+    columns = min(scores.shape[1], max(k, scores.shape[1] // KTH_SCORE_SAMPLE))
+    sample = scores[:, :columns]
+    return np.partition(sample, columns - k, axis=1)[:, columns - k]
+
+
+def substitution_matrix(matrix=None):
+    """
+    returns the score of each pair of residues of `ALPHABET` as an int16 matrix.
+    `matrix` is None or 'hamming' for the identity matrix (1 for the same residue, otherwise 0), or
+    the name of a substitution matrix of Biopython (ex: 'BLOSUM62', 'PAM250'). Pairs of residues that
+    aren't in the Biopython matrix get its lowest score.
+    """
+    if matrix is None or matrix.lower() == "hamming":
+        return np.eye(len(ALPHABET), dtype=np.int16)
+    # Biopython is only needed for the substitution matrices
+    from Bio.Align import substitution_matrices
+
+    scores = substitution_matrices.load(matrix)
+    table = np.full((len(ALPHABET), len(ALPHABET)), int(np.min(scores)), dtype=np.int16)
+    for i, a in enumerate(ALPHABET):
+        for j, b in enumerate(ALPHABET):
+            if a in scores.alphabet and b in scores.alphabet:
+                table[i, j] = int(scores[a][b])
+    return table
+
+
+def is_hamming(matrix):
+    return matrix is None or matrix.lower() == "hamming"
+
+
+class PeptideIndex:
+    """
+    an index of peptides for k-nearest-neighbor (`knn`) and radius (`radius`) queries
+
+    Parameters
+    ----------
+    peptides : list
+        the library peptides (AA sequences). Duplicates are only indexed once
+    binders : list, optional
+        binder peptides (ex: `final_binder_list.txt`). They are added to the index if they aren't in
+        `peptides`, and the results say which peptides are binders
+    """
+
+    def __init__(self, peptides, binders=()):
+        library = pd.unique(np.asarray(list(peptides), dtype=object))
+        binders = pd.unique(np.asarray(list(binders), dtype=object))
+        self.peptides = pd.unique(np.concatenate([library, binders])).astype(object)
+        # hashed lookups (`np.isin` compares every pair of strings of object arrays)
+        self.library = pd.Series(self.peptides).isin(library).to_numpy()
+        self.binder = pd.Series(self.peptides).isin(binders).to_numpy()
+        self._build()
+
+    def _build(self):
+        lengths = np.fromiter((len(p) for p in self.peptides), dtype=np.int64, count=len(self.peptides))
+        # the rows (numbers in `peptides`) and the position codes (`position_codes`) of each length
+        self.rows = {}
+        self.codes = {}
+        for length in np.unique(lengths).tolist():
+            rows = np.flatnonzero(lengths == length)
+            self.rows[length] = rows
+            self.codes[length] = position_codes(encode_peptides(self.peptides[rows], length), length)
+
+    def __len__(self):
+        return len(self.peptides)
+
+    def save(self, path):
+        """saves the index to a .npz file (see `load`)"""
+        np.savez(
+            path,
+            peptides=self.peptides.astype(str),
+            library=self.library,
+            binder=self.binder,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """loads an index saved with `save`"""
+        index = cls.__new__(cls)
+        with np.load(path, allow_pickle=False) as saved:
+            index.peptides = saved["peptides"].astype(object)
+            index.library = saved["library"]
+            index.binder = saved["binder"]
+        index._build()
+        return index
+
+    def _search(self, queries, matrix, select):
+        """
+        scores `queries` against the peptides of their length in blocks and returns the results
+        table. `select(scores, length)` returns the (query number in the block, column) of the hits
+        of a block, sorted by query and then from the best to the worst hit
+        """
+        queries = [str(q) for q in queries]
+        table = substitution_matrix(matrix)
+        query_lengths = np.array([len(q) for q in queries], dtype=np.int64)
+        found = []
+        for length, rows in self.rows.items():
+            query_numbers = np.flatnonzero(query_lengths == length)
+            if len(query_numbers) == 0:
+                continue
+            codes = self.codes[length]
+            residues = encode_peptides([queries[i] for i in query_numbers], length)
+            block = max(1, QUERY_BLOCK_SIZE // len(rows))
+            for start in range(0, len(query_numbers), block):
+                block_residues = residues[start:start + block]
+                scores = np.zeros((len(block_residues), len(rows)), dtype=np.int16)
+                for group_codes, positions in zip(codes, position_groups(length)):
+                    scores += group_scores(table, block_residues, positions)[:, group_codes]
+                hit_queries, hit_columns = select(scores, length)
+                found.append(
+                    (query_numbers[start:start + block][hit_queries], rows[hit_columns], scores[hit_queries, hit_columns], length)
+                )
+        query_numbers = np.concatenate([f[0] for f in found]) if found else np.zeros(0, dtype=np.int64)
+        peptide_rows = np.concatenate([f[1] for f in found]) if found else np.zeros(0, dtype=np.int64)
+        scores = np.concatenate([f[2] for f in found]) if found else np.zeros(0, dtype=np.int16)
+        lengths = np.concatenate([np.full(len(f[0]), f[3]) for f in found]) if found else np.zeros(0, dtype=np.int64)
+        # the queries in their original order (the hits of each query are already sorted)
+        order = np.argsort(query_numbers, kind="stable")
+        query_numbers, peptide_rows, scores, lengths = (
+            query_numbers[order], peptide_rows[order], scores[order], lengths[order]
+        )
+        results = pd.DataFrame(
+            {
+                "query": np.asarray(queries, dtype=object)[query_numbers],
+                "peptide": self.peptides[peptide_rows],
+            }
+        )
+        if is_hamming(matrix):
+            results["distance"] = lengths - scores
+        else:
+            results["score"] = scores.astype(np.int64)
+        results["library"] = self.library[peptide_rows]
+        results["binder"] = self.binder[peptide_rows]
+        return results
+
+    def knn(self, queries, k=10, matrix=None):
+        """
+        returns the `k` peptides most similar to each query (fewer if there aren't `k` peptides of its
+        length), from the most to the least similar, with ties in the order of the index
+
+        Parameters
+        ----------
+        queries : list
+            query peptides
+        k : int, optional
+            the number of neighbors, by default 10
+        matrix : str, optional
+            None or 'hamming' for Hamming distance, or a substitution matrix name (ex: 'BLOSUM62')
+
+        Returns
+        -------
+        DataFrame
+            `query`, `peptide`, `distance` (Hamming) or `score` (substitution matrix), and whether the
+            peptide is in the `library` and is a `binder`
+        """
+
+        def select(scores, length):
+            n = min(k, scores.shape[1])
+            if n <= 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            # every peptide with at least the bound of the k-th highest score of its query is a
+            # candidate, and the first k by score and then by order in the index are kept (so ties at
+            # the k-th neighbor are deterministic)
+            hit_queries, hit_columns = np.nonzero(scores >= kth_score_bounds(scores, n)[:, np.newaxis])
+            order = np.lexsort((hit_columns, -scores[hit_queries, hit_columns].astype(np.int64), hit_queries))
+            hit_queries, hit_columns = hit_queries[order], hit_columns[order]
+            rank = np.arange(len(hit_queries)) - np.searchsorted(hit_queries, hit_queries)
+            return hit_queries[rank < n], hit_columns[rank < n]
+
+        return self._search(queries, matrix, select)
+
+    def radius(self, queries, max_distance=None, min_score=None, matrix=None):
+        """
+        returns every peptide within `max_distance` substitutions (Hamming) or with a score of at least
+        `min_score` (substitution matrix) of each query, from the most to the least similar
+
+        Parameters
+        ----------
+        queries : list
+            query peptides
+        max_distance : int, optional
+            the largest Hamming distance (with the default `matrix`)
+        min_score : int, optional
+            the lowest substitution matrix score (with a `matrix`)
+        matrix : str, optional
+            None or 'hamming' for Hamming distance, or a substitution matrix name (ex: 'BLOSUM62')
+
+        Returns
+        -------
+        DataFrame
+            the same columns as `knn`
+        """
+        if is_hamming(matrix) and max_distance is None:
+            raise ValueError("radius queries by Hamming distance need a `max_distance`")
+        if not is_hamming(matrix) and min_score is None:
+            raise ValueError(f"radius queries by {matrix} score need a `min_score`")
+
+        def select(scores, length):
+            threshold = length - max_distance if is_hamming(matrix) else min_score
+            hit_queries, hit_columns = np.nonzero(scores >= threshold)
+            order = np.lexsort((hit_columns, -scores[hit_queries, hit_columns].astype(np.int64), hit_queries))
+            return hit_queries[order], hit_columns[order]
+
+        return self._search(queries, matrix, select)
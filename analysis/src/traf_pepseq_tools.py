@@ -1,40 +1,397 @@
+import itertools
+import multiprocessing
 import os
+import re
 import numpy as np
 import pandas as pd
-from Bio import Seq
+
+
+# `filter_nonsense_seqs` removes peptides containing any of NONSENSE_RESIDUES and keeps the ones
+# with BINDING_MOTIF (see `parse_motif`) anywhere in their sequence
+NONSENSE_RESIDUES = "*X"
+BINDING_MOTIF = "...P.E..."
+
+# read counts are stored as COUNT_DTYPE (4 bytes per count)
+COUNT_DTYPE = np.uint32
+
+# extension of the binary count tables (`count_sequences.py --npz`)
+COUNT_TABLE_EXTENSION = ".npz"
+
+# 2-bit packing of nt sequences (see `pack_seqs`)
+PACKED_BASES = "ACGT"
+MAX_PACKED_LENGTH = 31
+ESCAPE_BIT = np.uint64(1 << 63)
+BASE_VALUES = np.full(256, 255, dtype=np.uint8)
+BASE_VALUES[np.frombuffer(PACKED_BASES.encode(), dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+# number of 1 bits of each byte (see `base_differences`)
+BIT_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# standard genetic code, by codon in the order AAA, AAC, AAG, AAT, ACA, ... (A=0, C=1, G=2, T=3)
+CODON_TABLE = np.frombuffer(
+    b"KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVV*Y*YSSSS*CWCLFLF", dtype=np.uint8
+)
+# translations of the codons that aren't only A/C/G/T (ex: `CTN`), see `translate_codon`
+AMBIGUOUS_CODONS = {}
+# translations of every sequence translated so far (see `translate_seqs`). It is
+# cleared when it would grow past TRANSLATION_CACHE_SIZE sequences
+TRANSLATIONS = {}
+TRANSLATION_CACHE_SIZE = 2000000
+
+# number of replicates processed at the same time when parameters.json doesn't set `replicate processes`
+REPLICATE_PROCESSES = 1
+
+
+def translate_codon(codon):
+    """
+    translates a codon that isn't only A/C/G/T with Biopython (imported the first time
+    it's needed) and remembers the result
+    """
+    if codon not in AMBIGUOUS_CODONS:
+        from Bio import Seq
+
+        AMBIGUOUS_CODONS[codon] = str(Seq.Seq(codon).translate())
+    return AMBIGUOUS_CODONS[codon]
+
+
+def char_matrices(strings):
+    """
+    groups an object array of strings by length.
+    returns a list of (rows, matrix) for each length, where `rows` are the indexes of the strings of
+    that length and `matrix` is a uint8 array of their characters (one string per row), or None if
+    some of them have non-ascii characters
+    """
+    lengths = np.fromiter((len(x) for x in strings), dtype=np.int64, count=len(strings))
+    matrices = []
+    for length in np.unique(lengths):
+        rows = np.flatnonzero(lengths == length)
+        joined = "".join(strings[rows]).encode()
+        if len(joined) != len(rows) * length:
+            matrices.append((rows, None))
+        else:
+            matrices.append((rows, np.frombuffer(joined, dtype=np.uint8).reshape(len(rows), length)))
+    return matrices
+
+
+def translate_matrix(matrix):
+    """
+    translates a uint8 matrix of nt sequences (one sequence per row, see `char_matrices`) with
+    `CODON_TABLE`. Sequences are truncated to a multiple of 3 nt (like `trans_string`).
+    returns a uint8 matrix of the amino acids (one column per codon)
+    """
+    n_codons = matrix.shape[1] // 3
+    codon_matrix = matrix[:, : n_codons * 3].reshape(len(matrix), n_codons, 3)
+    values = BASE_VALUES[codon_matrix].astype(np.int16)
+    codons = values[:, :, 0] * 16 + values[:, :, 1] * 4 + values[:, :, 2]
+    aa = CODON_TABLE[np.minimum(codons, 63)]
+    for r, c in zip(*np.nonzero((values == 255).any(axis=2))):
+        aa[r, c] = ord(translate_codon(codon_matrix[r, c].tobytes().decode()))
+    return aa
+
+
+def matrix_strings(matrix):
+    """returns an object array of the strings (str) in the rows of a uint8 character matrix"""
+    if matrix.shape[1] == 0:
+        return np.full(len(matrix), "", dtype=object)
+    matrix = np.ascontiguousarray(matrix)
+    return matrix.view(f"S{matrix.shape[1]}").ravel().astype(str).astype(object)
+
+
+def translate_new_seqs(seqs):
+    """
+    translates an object array of nt sequences with `CODON_TABLE`, one length at a time.
+    Sequences are truncated to a multiple of 3 nt (like `trans_string`)
+    """
+    translations = np.empty(len(seqs), dtype=object)
+    for rows, matrix in char_matrices(seqs):
+        if matrix is None:
+            for i in rows:
+                n_codons = len(seqs[i]) // 3
+                translations[i] = "".join(
+                    translate_codon(seqs[i][j : j + 3]) for j in range(0, n_codons * 3, 3)
+                )
+        else:
+            translations[rows] = matrix_strings(translate_matrix(matrix))
+    return translations
+
+
+def translate_seqs(seqs):
+    """
+    translates nt sequences (truncated to a multiple of 3 nt) with the standard genetic code.
+    Gives the same translations as `trans_string` for every sequence, but translates all of
+    the sequences at once with a 64 entry codon lookup table (`CODON_TABLE`). Each distinct
+    sequence is only translated once, and its translation is kept in `TRANSLATIONS` so
+    that sequences seen before (ex: in another replicate) aren't translated again.
+    returns an object array of the amino acid sequences (str)
+    """
+    codes, unique_seqs = pd.factorize(np.asarray(seqs, dtype=object))
+    unique_seqs = np.asarray(unique_seqs, dtype=object)
+    translations = np.array([TRANSLATIONS.get(x) for x in unique_seqs], dtype=object)
+    missing = np.flatnonzero(np.equal(translations, None))
+    if len(missing) > 0:
+        new = translate_new_seqs(unique_seqs[missing])
+        translations[missing] = new
+        if len(TRANSLATIONS) + len(missing) > TRANSLATION_CACHE_SIZE:
+            TRANSLATIONS.clear()
+        TRANSLATIONS.update(zip(unique_seqs[missing], new))
+    return translations[codes]
 
 
 def trans_string(s):
-    l = int(len(s)/3)*3
-    return str(Seq.Seq(s[0:l]).translate())
+    return translate_seqs([s])[0]
+
+
+def count_table_path(file):
+    """
+    returns the path of the binary count table (`barcode_x_f_nts_only.npz`) of the
+    barcode_x_f_nts_only file `file` if it exists and is not older than the text file,
+    otherwise None
+    """
+    if file.endswith(COUNT_TABLE_EXTENSION):
+        return file
+    npz_file = file + COUNT_TABLE_EXTENSION
+    if not os.path.exists(npz_file):
+        return None
+    if os.path.exists(file) and os.path.getmtime(npz_file) < os.path.getmtime(file):
+        return None
+    return npz_file
 
 
 def df_import_1(file):
     """
     imports barcode_x_f_nts_only file.
-    returns a dataframe of the nt sequences (`seq`) and their counts (column named after file name `barcode_x`)
+    returns a dataframe of the nt sequences (`seq`) and their counts (column named after file name `barcode_x`,
+    `COUNT_DTYPE`)
+    If the binary count table written by `count_sequences.py --npz` (`barcode_x_f_nts_only.npz`)
+    is next to the file (or `file` is the .npz file itself), it is loaded instead of parsing the text.
     """
     base = os.path.basename(file)
     basenoext = os.path.splitext(base)[0].replace("_f_nts_only", "")
+    npz_file = count_table_path(file)
+    if npz_file is not None:
+        with np.load(npz_file, allow_pickle=False) as table:
+            return pd.DataFrame(
+                {
+                    basenoext: table["count"].astype(COUNT_DTYPE),
+                    "seq": table["seq"].astype(str).astype(object),
+                }
+            )
+    # the second ("useless") column isn't parsed
     df = pd.read_csv(
         file,
         sep="\t",
         header=None,
-        names=[basenoext, "useless", "seq"]
-    ).drop("useless", axis=1)
+        names=[basenoext, "useless", "seq"],
+        usecols=[basenoext, "seq"],
+        dtype={basenoext: COUNT_DTYPE},
+    )
     return df
 
 
-def load_and_merge_data(file_list, excluded_barcodes=None):
+def pack_seqs(seqs, length, escapes, lengths=None):
+    """
+    packs nt sequences into uint64 codes with 2 bits per base (A=0, C=1, G=2, T=3,
+    first base in the highest bits), so that sequences of `length` (<= 31) nt take 8
+    bytes each and sort in the same order as the strings.
+    Sequences that can't be packed (they contain N or another character, or have a
+    different length) get the code `ESCAPE_BIT | n`, where n is their number in the
+    `escapes` dictionary (sequence -> n). `escapes` is updated in place, so that it
+    can be shared by all of the files of one merge.
+    `lengths` (the length of each sequence) is computed if it isn't given.
+    returns a uint64 array of codes
+    """
+    seqs = np.asarray(seqs, dtype=object)
+    if lengths is None:
+        lengths = np.fromiter((len(x) for x in seqs), dtype=np.int64, count=len(seqs))
+    same_length = lengths == length
+    codes = np.zeros(len(seqs), dtype=np.uint64)
+    if same_length.any():
+        joined = "".join(seqs[same_length]).encode()
+        values = BASE_VALUES[np.frombuffer(joined, dtype=np.uint8).reshape(-1, length)]
+        packed = np.zeros(len(values), dtype=np.uint64)
+        for column in values.T:
+            packed <<= np.uint64(2)
+            packed |= column
+        packed[(values == 255).any(axis=1)] = ESCAPE_BIT
+        codes[same_length] = packed
+    escaped = np.flatnonzero(~same_length | (codes == ESCAPE_BIT))
+    for i in escaped:
+        codes[i] = ESCAPE_BIT | np.uint64(escapes.setdefault(seqs[i], len(escapes)))
+    return codes
+
+
+def unpack_seqs(codes, length, escapes):
+    """
+    returns an array of the nt sequences (str) of the uint64 `codes` made by `pack_seqs`
+    with the same `length` and `escapes`
+    """
+    values = np.empty((len(codes), length), dtype=np.uint8)
+    remaining = codes.copy()
+    for i in range(length - 1, -1, -1):
+        values[:, i] = remaining & np.uint64(3)
+        remaining >>= np.uint64(2)
+    letters = np.frombuffer(PACKED_BASES.encode(), dtype=np.uint8)[values]
+    seqs = letters.view(f"S{length}").ravel().astype(str).astype(object)
+    escaped = np.flatnonzero(codes & ESCAPE_BIT)
+    if len(escaped) > 0:
+        by_number = {n: seq for seq, n in escapes.items()}
+        for i in escaped:
+            seqs[i] = by_number[int(codes[i] & ~ESCAPE_BIT)]
+    return seqs
+
+
+def base_differences(codes1, codes2):
+    """returns the number of bases that differ between each pair of packed sequences (`pack_seqs`)"""
+    x = np.bitwise_xor(codes1, codes2)
+    # 1 in the low bit of every base that differs
+    x = (x | (x >> np.uint64(1))) & np.uint64(0x5555555555555555)
+    return BIT_COUNTS[np.ascontiguousarray(x).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def hamming_neighbors(codes, length, max_distance=1):
+    """
+    finds the pairs of packed sequences (`pack_seqs`) of `length` nt that differ at 1 to `max_distance`
+    bases. Escaped codes are skipped.
+    Comparing every pair is quadratic, so the pairs are found with a wildcard index instead: for each
+    combination of `max_distance` positions, the codes are sorted with the bases at those positions
+    masked. Sequences that only differ at those positions then have the same masked code and end up
+    next to each other in groups of at most 4 ** `max_distance`. That's C(`length`, `max_distance`)
+    sorts of the codes (31 for `max_distance`=1 with 31 nt sequences).
+    returns 2 arrays (i, j) of the indexes of the pairs in `codes` (i < j, each pair once)
+    """
+    rows = np.flatnonzero((codes & ESCAPE_BIT) == 0)
+    packed = codes[rows]
+    pairs = []
+    if len(rows) > 1 and 0 < max_distance <= length:
+        for positions in itertools.combinations(range(length), max_distance):
+            mask = np.uint64(0)
+            for position in positions:
+                mask |= np.uint64(3) << np.uint64(2 * (length - 1 - position))
+            masked = packed & ~mask
+            order = np.argsort(masked, kind="stable")
+            masked = masked[order]
+            for offset in range(1, 4 ** max_distance):
+                same = masked[:-offset] == masked[offset:]
+                if not same.any():
+                    break
+                pairs.append(np.sort(np.stack([order[:-offset][same], order[offset:][same]]), axis=0))
+    if len(pairs) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # with `max_distance` > 1, a pair is found once for every combination of positions that covers
+    # the bases where it differs
+    pairs = np.unique(np.concatenate(pairs, axis=1), axis=1)
+    return rows[pairs[0]], rows[pairs[1]]
+
+
+def correct_errors(df1, col, max_distance=1, ratio=5):
+    """
+    merges sequencing error variants into the sequences they most likely came from.
+    A sequence (child) is merged into a sequence (parent) that differs from it at <= `max_distance`
+    bases (`hamming_neighbors`) and has >= `ratio` times its read count in `col`. If there are several
+    such parents, the one with the most reads is used, and the reads of children of children go to the
+    end of the chain. Sequences that can't be packed (`pack_seqs`, ex: containing N) aren't corrected.
+
+    Parameters
+    ----------
+    df1 : DataFrame
+        a read count table with one row per nt sequence (`seq`), like the ones `df_import_1` returns
+    col : str
+        the read count column
+    max_distance : int, optional
+        the largest number of differing bases, by default 1
+    ratio : float, optional
+        the minimum ratio of the parent's reads to the child's reads (> 1), by default 5
+
+    Returns
+    -------
+    DataFrame
+        `df1` without the merged sequences, and with their reads added to their parents (rows in the same order)
+    dict
+        the number of sequences and reads in `df1` and how many of them were merged
+        (`sequences`, `merged sequences`, `parent sequences`, `reads`, `merged reads`)
+    """
+    if ratio <= 1:
+        raise ValueError(f"the parent/child read count ratio has to be > 1, not {ratio}")
+    seqs = df1["seq"].to_numpy()
+    counts = df1[col].to_numpy().astype(np.int64)
+    lengths = np.fromiter((len(x) for x in seqs), dtype=np.int64, count=len(seqs))
+    length = min(int(np.bincount(lengths).argmax()), MAX_PACKED_LENGTH) if len(lengths) > 0 else 0
+    codes = pack_seqs(seqs, length, {}, lengths)
+    i, j = hamming_neighbors(codes, length, max_distance)
+    parents = np.where(counts[i] >= counts[j], i, j)
+    children = np.where(counts[i] >= counts[j], j, i)
+    keep = counts[parents] >= ratio * counts[children]
+    parents, children = parents[keep], children[keep]
+    # the parent with the most reads (then the first one) of each child
+    order = np.lexsort((parents, -counts[parents], children))
+    parents, children = parents[order], children[order]
+    first = np.ones(len(children), dtype=bool)
+    first[1:] = children[1:] != children[:-1]
+    parent = np.arange(len(df1))
+    parent[children[first]] = parents[first]
+    # parents have more reads than their children, so following the chains always ends
+    while True:
+        grandparent = parent[parent]
+        if (grandparent == parent).all():
+            break
+        parent = grandparent
+    merged = parent != np.arange(len(df1))
+    corrected = np.zeros(len(df1), dtype=np.int64)
+    np.add.at(corrected, parent, counts)
+    df = df1[~merged].assign(**{col: corrected[~merged].astype(df1[col].dtype)})
+    report = {
+        "sequences": len(df1),
+        "merged sequences": int(merged.sum()),
+        "parent sequences": len(np.unique(parent[merged])),
+        "reads": int(counts.sum()),
+        "merged reads": int(counts[merged].sum()),
+    }
+    return df, report
+
+
+def print_error_correction_report(name, report):
+    reads_percent = 100 * report["merged reads"] / report["reads"] if report["reads"] > 0 else 0
+    print(
+        f"error correction of {name}: merged {report['merged sequences']} of {report['sequences']} sequences "
+        f"({report['merged reads']} reads, {reads_percent:.2f}% of the reads) into {report['parent sequences']} sequences"
+    )
+
+
+def error_corrected_table(df1, error_correction=None):
+    """
+    returns the count table `df1` from `df_import_1` with `correct_errors` applied if `error_correction`
+    (the `error correction` parameters: `max distance` and `ratio`) is given, and prints the report
+    """
+    if not error_correction:
+        return df1
+    col = df1.columns[0]
+    df, report = correct_errors(
+        df1, col, max_distance=error_correction["max distance"], ratio=error_correction["ratio"]
+    )
+    print_error_correction_report(col, report)
+    return df
+
+
+def load_and_merge_data(file_list, excluded_barcodes=None, error_correction=None):
     """
     TODO: output from: {script name}
     load NGS data (output from: ) and merge into a single DataFrame
     DataFrame will be the nt sequences (`seq`) and their counts for each barcode file in `file_list`
     each barcode file in `file_list` should correspond to 1 column in the Dataframe.
     columns are sorted in numerical order (ex: `seq` | `barcode_1` | `barcode_2` | ...)
+    with `error_correction` (see `error_corrected_table`), the sequencing error variants of each file
+    are merged into their parents before the files are merged
     """
     # R will be the read counts for each sequence in each gate
-    R = pd.DataFrame(columns=["seq"])
+    # all of the files are read first, and the packed sequences (see `pack_seqs`)
+    # of every file are numbered at once with `pd.factorize`, so the rows keep the
+    # order in which the sequences first appear in the files. That is also the row
+    # order of the chained outer merges this replaced on the pinned pandas (1.3.4,
+    # traf_analysis_env_full.yml); newer pandas (>= 2.2) sorts the keys of an outer
+    # merge, so the old code gives a different row order there.
+    # The counts are then filled into an integer (`COUNT_DTYPE`) matrix with one row
+    # per sequence, so each file is only touched once.
+    tables = []
     for f in file_list:
         if excluded_barcodes:
             if (
@@ -43,9 +400,26 @@ def load_and_merge_data(file_list, excluded_barcodes=None):
             ):
                 continue
         print("processing file: {}".format(f))
-        df1 = df_import_1(f)
-        R = pd.merge(R, df1, on="seq", how="outer")
-    R = R.fillna(0)
+        tables.append(error_corrected_table(df_import_1(f), error_correction))
+    if len(tables) == 0:
+        R = pd.DataFrame(columns=["seq"])
+    else:
+        lengths = [df1["seq"].str.len().to_numpy() for df1 in tables]
+        all_lengths = np.concatenate(lengths)
+        length = min(int(np.bincount(all_lengths).argmax()), MAX_PACKED_LENGTH) if len(all_lengths) > 0 else 0
+        escapes = {}
+        codes = np.concatenate(
+            [pack_seqs(df1["seq"], length, escapes, seq_lengths) for df1, seq_lengths in zip(tables, lengths)]
+        )
+        rows, unique_codes = pd.factorize(codes)
+        counts = np.zeros((len(unique_codes), len(tables)), dtype=COUNT_DTYPE)
+        start = 0
+        for i, df1 in enumerate(tables):
+            end = start + len(df1)
+            counts[rows[start:end], i] = df1.iloc[:, 0].to_numpy()
+            start = end
+        R = pd.DataFrame(counts, columns=[df1.columns[0] for df1 in tables])
+        R.insert(0, "seq", unpack_seqs(np.asarray(unique_codes, dtype=np.uint64), length, escapes))
     # reorder columns
     barcode_cols = [col for col in R.columns]
     barcode_cols.sort()
@@ -54,29 +428,108 @@ def load_and_merge_data(file_list, excluded_barcodes=None):
     return R, barcode_cols
 
 
-def collapse_counts(df1, cols):
+def collapse_counts(df1, cols, translate=True):
     '''
     remove last 4 nt from sequences corresponding to the static region of the template plasmid.
     Then collapse readcounts for duplicate sequences present after removing static region. 
     then re-translate the sequences (since only the `cols` and `seq` columns are saved when it's collapsed)
+    with translate=False, the `AA_seq` column isn't added, so that `filter_nonsense_seqs` only translates
+    the sequences that pass the filter
     '''
-    df = df1.copy()
-    df['seq'] = df.seq.str[:-4]
-    df=df.groupby('seq')[cols].sum()
+    # grouped by the shortened sequences without copying `df1`
+    df=df1.groupby(df1.seq.str[:-4])[cols].sum()
     df=df.reset_index()
-    df['AA_seq'] = df['seq'].apply(trans_string)
+    if translate:
+        df['AA_seq'] = translate_seqs(df['seq'].to_numpy())
     df = df.sort_values(cols, ascending=False)
     return df
 
 
+def parse_motif(motif):
+    """
+    parses a position specific motif written as a regular expression made of `.` (any residue),
+    single residues and residue classes in brackets (ex: `...P.[ST]E`).
+    returns a list with the allowed residues at each position of the motif (a uint8 array of
+    characters), or None for the positions that allow any residue
+    """
+    positions = []
+    i = 0
+    while i < len(motif):
+        if motif[i] == ".":
+            positions.append(None)
+        elif motif[i] == "[":
+            end = motif.find("]", i)
+            if end < 0 or end == i + 1 or "^" in motif[i:end] or "-" in motif[i:end]:
+                raise ValueError(f"unsupported residue class in motif {motif!r}")
+            positions.append(np.frombuffer(motif[i + 1 : end].replace("\\", "").encode(), dtype=np.uint8))
+            i = end
+        elif motif[i] == "\\" and i + 1 < len(motif):
+            i += 1
+            positions.append(np.frombuffer(motif[i].encode(), dtype=np.uint8))
+        elif motif[i].isalpha() or motif[i] == "-":
+            positions.append(np.frombuffer(motif[i].encode(), dtype=np.uint8))
+        else:
+            raise ValueError(f"unsupported character {motif[i]!r} in motif {motif!r}")
+        i += 1
+    return positions
+
+
+def motif_mask(matrix, motif):
+    """
+    returns a boolean array of the rows of a uint8 matrix of peptides (see `char_matrices`) that
+    contain `motif` (a string or the output of `parse_motif`) at any position, like
+    `str.contains(motif)` on the peptide strings
+    """
+    positions = parse_motif(motif) if isinstance(motif, str) else motif
+    mask = np.zeros(len(matrix), dtype=bool)
+    for offset in range(matrix.shape[1] - len(positions) + 1):
+        found = np.ones(len(matrix), dtype=bool)
+        for i, allowed in enumerate(positions):
+            if allowed is not None:
+                found &= np.isin(matrix[:, offset + i], allowed)
+        mask |= found
+    return mask
 
-def filter_nonsense_seqs(df1):
+
+def peptide_mask(matrix, motif=BINDING_MOTIF, excluded=NONSENSE_RESIDUES):
+    """
+    returns a boolean array of the rows of a uint8 matrix of peptides that don't contain any of
+    the `excluded` residues and contain `motif` (see `motif_mask`)
+    """
+    mask = ~np.isin(matrix, np.frombuffer(excluded.encode(), dtype=np.uint8)).any(axis=1)
+    return mask & motif_mask(matrix, motif)
+
+
+def filter_nonsense_seqs(df1, motif=BINDING_MOTIF, excluded=NONSENSE_RESIDUES):
     '''
     return list of nt sequences not containing * or X and matching regex ...P.E...
+    (`excluded` and `motif`, see `parse_motif`).
+    The peptides are checked as uint8 character matrices (one per peptide length, see `peptide_mask`).
+    If `df1` has no `AA_seq` column (`collapse_counts(..., translate=False)`), the sequences are
+    translated into a matrix, and `AA_seq` is only made for the sequences that pass the filter.
     '''
-    df = df1.copy()
-    df = df[~df.AA_seq.str.contains(r"[\*X]")]
-    df = df[df.AA_seq.str.contains(r"...P.E...")]
+    positions = parse_motif(motif)
+    translate = "AA_seq" not in df1.columns
+    strings = df1["seq" if translate else "AA_seq"].to_numpy(dtype=object)
+    mask = np.zeros(len(df1), dtype=bool)
+    aa_seqs = np.empty(len(df1), dtype=object)
+    for rows, matrix in char_matrices(strings):
+        if matrix is None:
+            peptides = translate_new_seqs(strings[rows]) if translate else strings[rows]
+            peptides = pd.Series(peptides, dtype=object)
+            excluded_pattern = "[" + re.escape(excluded) + "]"
+            mask[rows] = (~peptides.str.contains(excluded_pattern) & peptides.str.contains(motif)).to_numpy()
+            aa_seqs[rows] = peptides.to_numpy()
+            continue
+        if translate:
+            matrix = translate_matrix(matrix)
+        passed = peptide_mask(matrix, positions, excluded)
+        mask[rows] = passed
+        if translate:
+            aa_seqs[rows[passed]] = matrix_strings(matrix[passed])
+    df = df1[mask].copy()
+    if translate:
+        df["AA_seq"] = aa_seqs[mask]
     return df
 
 
@@ -100,3 +553,21 @@ def union_2_lists(l1, l2):
     return list(sl1.union(sl2))
 
 
+
+
+def replicate_processes(params):
+    '''the number of worker processes for the replicates (`replicate processes` in parameters.json)'''
+    return params.get("replicate processes", REPLICATE_PROCESSES)
+
+
+def map_replicates(function, arg_lists, processes=1):
+    '''
+    returns `[function(*args) for args in arg_lists]`. With `processes` > 1 the calls are divided
+    between that many processes (`function` has to be defined at the top level of a module), and the
+    results are still in the order of `arg_lists`
+    '''
+    processes = min(processes, len(arg_lists))
+    if processes <= 1:
+        return [function(*args) for args in arg_lists]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.starmap(function, arg_lists)
@@ -0,0 +1,206 @@
+"""
+sweeps the `final binder readcount filters` of s04 over a grid of values, to see how sensitive the
+final binder list is to them.
+
+python sweep_binder_filters.py [--initial-count-cutoff 20 50 100] [--mask-count-cutoff 10 20]
+    [--day45-cutoff 20 50] [--enrichment-cutoff 1 2 3] [--processes N] [--output sweep]
+
+The merged enrichment tables listed in parameters.json (written by s01) are collapsed and filtered
+for nonsense sequences once. For each `initial_count_cutoff`, the read fractions are calculated once
+(they depend on which sequences pass the cutoff), and for each `mask_count_cutoff` the number of
+days each sequence enriched is calculated once. Every `day45_cutoff` and `enrichment_cutoff` is then
+just a comparison with the precomputed day 4/5 counts and number of days enriched. The
+(`initial_count_cutoff`, `mask_count_cutoff`) pairs are divided between `--processes` processes.
+
+The binder lists are the same as the ones s04 would make with each combination of filters.
+Writes [output].csv with the number of binders of each replicate and of the final binder list (the
+union of the replicates) for every combination, and [output]_binders.json with the final binder
+lists themselves.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+import src.traf_pepseq_tools as traf_tools
+import s01_compile_enrichment_tables as s01
+import s02_filter_enrichment_tables as s02
+import s04_binder_processing as s04
+
+FILTER_NAMES = ['initial_count_cutoff', 'mask_count_cutoff', 'day45_cutoff', 'enrichment_cutoff']
+
+# set in each worker process by `set_sweep_data` (shared with fork instead of sent with every task)
+SWEEP_DATA = None
+
+
+def set_sweep_data(data):
+    global SWEEP_DATA
+    SWEEP_DATA = data
+
+
+def precompute(tables, cols):
+    """returns the data that every grid point of a sweep shares
+
+    Parameters
+    ----------
+    tables : list of DataFrame
+        the collapsed read count tables of each replicate, filtered for nonsense sequences
+        (`s02.collapse_and_filter_nonsense`) but not for read counts
+    cols : list
+        the count columns
+
+    Returns
+    -------
+    dict
+        the `enrichment_tensor` of the tables (`seqs`, `aa_seqs`, `counts`, `present`), the largest
+        count of each sequence in any column (`max_counts`) and on day 4 or 5 (`late_counts`)
+    """
+    seqs, aa_seqs, counts, present = s04.enrichment_tensor(tables, cols)
+    return {
+        'cols': cols,
+        'aa_seqs': aa_seqs,
+        'counts': counts,
+        'present': present,
+        'max_counts': counts.max(axis=1),
+        'late_counts': s04.late_day_counts(counts, cols),
+    }
+
+
+def sweep_point(initial_count_cutoff, mask_count_cutoff, day45_cutoffs, enrichment_cutoffs, data=None):
+    """
+    returns a list of (filters, binder lists of each replicate) for one `initial_count_cutoff` and
+    `mask_count_cutoff` and every combination of `day45_cutoffs` and `enrichment_cutoffs`
+    """
+    data = SWEEP_DATA if data is None else data
+    # the sequences that pass `filter_across_multiple_columns` with `initial_count_cutoff`
+    present = data['present'] & (data['max_counts'] >= initial_count_cutoff)
+    counts = data['counts'] * present[:, np.newaxis, :]
+    n_days_enriched = s04.days_enriched(counts, data['cols'], mask_count_cutoff=mask_count_cutoff)
+    results = []
+    for day45_cutoff, enrichment_cutoff in itertools.product(day45_cutoffs, enrichment_cutoffs):
+        mask = present & (data['late_counts'] >= day45_cutoff) & (n_days_enriched >= enrichment_cutoff)
+        binders = [list(pd.unique(data['aa_seqs'][replicate_mask])) for replicate_mask in mask]
+        filters = dict(zip(FILTER_NAMES, [initial_count_cutoff, mask_count_cutoff, day45_cutoff, enrichment_cutoff]))
+        results.append((filters, binders))
+    return results
+
+
+def sweep_binders(tables, cols, grid, processes=1):
+    """evaluates the s04 binder filters at every point of a grid
+
+    Parameters
+    ----------
+    tables : dict
+        collapsed read count tables by experiment (replicate), filtered for nonsense sequences but not
+        for read counts (see `precompute`)
+    cols : list
+        the count columns
+    grid : dict
+        a list of values for each of `FILTER_NAMES`
+    processes : int, optional
+        number of processes that evaluate the grid, by default 1
+
+    Returns
+    -------
+    sizes : DataFrame
+        the filters, the number of binders of each experiment (`n binders [experiment]`) and the
+        number of final binders (the union of the experiments) of every grid point
+    final_binders : list
+        the sorted final binder list of each grid point (in the order of the rows of `sizes`)
+    """
+    experiments = list(tables.keys())
+    data = precompute([tables[exp] for exp in experiments], cols)
+    tasks = [
+        (initial_count_cutoff, mask_count_cutoff, grid['day45_cutoff'], grid['enrichment_cutoff'])
+        for initial_count_cutoff, mask_count_cutoff in itertools.product(grid['initial_count_cutoff'], grid['mask_count_cutoff'])
+    ]
+    if processes > 1:
+        with multiprocessing.Pool(processes, initializer=set_sweep_data, initargs=(data,)) as pool:
+            results = pool.starmap(sweep_point, tasks)
+    else:
+        results = [sweep_point(*task, data=data) for task in tasks]
+
+    rows = []
+    final_binders = []
+    for filters, binders in itertools.chain.from_iterable(results):
+        final = sorted(set().union(*binders))
+        row = dict(filters)
+        for exp, exp_binders in zip(experiments, binders):
+            row[f'n binders {exp}'] = len(exp_binders)
+        row['n final binders'] = len(final)
+        rows.append(row)
+        final_binders.append(final)
+    return pd.DataFrame(rows), final_binders
+
+
+def load_table(table_file, barcode_list, count_file_dir, sample_renaming_key, cols, error_correction=None):
+    """returns the collapsed and filtered (for nonsense sequences) enrichment table of one experiment"""
+    if table_file is not None:
+        R = pd.read_csv(table_file)
+    else:
+        # s01 hasn't been run
+        R = s01.compile_enrichment_table(barcode_list, count_file_dir, sample_renaming_key, error_correction=error_correction)
+    return s02.collapse_and_filter_nonsense(R, cols)
+
+
+def load_tables(params):
+    """returns the collapsed and filtered (for nonsense sequences) enrichment tables by experiment"""
+    cols = params['enrichment count columns']
+    table_files = params['filepaths'].get('merged enrichment tables', [])
+    jobs = []
+    for exp, barcode_list in params['experiment barcode lists'].items():
+        table_file = os.path.join(params['filepaths']['output directory'], exp + '_readcounts.csv')
+        if table_file not in table_files or not os.path.exists(table_file):
+            table_file = None
+        jobs.append((
+            table_file, barcode_list, params['filepaths']['sequence counts directory'], params['barcode name key'],
+            cols, params.get('error correction'),
+        ))
+    tables = traf_tools.map_replicates(load_table, jobs, traf_tools.replicate_processes(params))
+    return dict(zip(params['experiment barcode lists'].keys(), tables))
+
+
+def main(parameter_file, grid, output, processes=1):
+    with open(parameter_file) as f:
+        params = json.load(f)
+    tables = load_tables(params)
+    sizes, final_binders = sweep_binders(tables, params['enrichment count columns'], grid, processes=processes)
+    sizes.to_csv(output + '.csv', index=False)
+    print('file saved to {}'.format(output + '.csv'))
+    records = [
+        dict(filters, **{'final binders': binders})
+        for filters, binders in zip(sizes[FILTER_NAMES].to_dict('records'), final_binders)
+    ]
+    with open(output + '_binders.json', 'w') as f:
+        json.dump(records, f, indent=4, default=int)
+    print('file saved to {}'.format(output + '_binders.json'))
+    print(sizes.to_string(index=False))
+    return sizes, final_binders
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='evaluates the s04 final binder readcount filters on a grid of values')
+    for name in FILTER_NAMES:
+        parser.add_argument('--' + name.replace('_', '-'), type=int, nargs='+', default=None,
+                            help=f'values of {name} (default: the value in the --parameters file)')
+    parser.add_argument('--parameters', type=str, default='./parameters.json', help='the parameters file')
+    parser.add_argument('--processes', type=int, default=1, help='number of processes that evaluate the grid')
+    parser.add_argument('--output', type=str, default='binder_filter_sweep',
+                        help='the results are written to [output].csv and [output]_binders.json')
+    args = parser.parse_args()
+    # the filters that aren't given take their value in the parameters file
+    with open(args.parameters) as f:
+        defaults = json.load(f).get("final binder readcount filters", {})
+    grid = {}
+    for name in FILTER_NAMES:
+        if getattr(args, name) is not None:
+            grid[name] = getattr(args, name)
+        elif name in defaults:
+            grid[name] = [defaults[name]]
+        else:
+            parser.error(f'--{name.replace("_", "-")} is required ({name} is not in the "final binder readcount filters" of {args.parameters})')
+    main(args.parameters, grid, args.output, processes=args.processes)
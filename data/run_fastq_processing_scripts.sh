@@ -8,8 +8,14 @@ barcode_directory="./fastq_files/"
 #== bbmap `reformat` executable ==#
 reformat_command="reformat.sh"
 
+#== set to "--stream" to filter and count the fastq files directly (bbtools is not used) ==#
+stream=""
+
+#== number of jobs per stage, e.g. "--reformat-workers 2 --fq2str-workers 2 --count-workers 4" ==#
+workers=""
+
 # ==============================================================================
 # // Run scripts
 # ==============================================================================
 
-python ./src/main_process_and_count_barcodes.py $barcode_directory $reformat_command
+python ./src/main_process_and_count_barcodes.py $barcode_directory $reformat_command $stream $workers
@@ -0,0 +1,265 @@
+'''
+Benchmarks the read counting hot paths on synthetic reads, and checks that the
+fast paths give the same output as the reference implementation.
+
+Run from the data directory with python2:
+python ./src/benchmark.py [--reads N] [--library-size N] [--skew S] [--mismatch-rate R]
+
+The synthetic reads are built from the template of the first of the
+SORTING_TASKS in count_sequences.py: a library of random variants is made by
+filling the VARIABLE_REGION_TOKEN positions with NNK codons, and reads are drawn
+from the library with Zipf-like abundances (the variant of rank r is drawn with
+a weight of 1 / r ** skew), like the few highly abundant sequences and long tail
+of the real libraries. Each base of a read is then replaced by a random base
+with probability mismatch_rate, or by N with probability n_rate.
+
+Timed:
+    - Aligner.align (the reference alignment, on a subset of the reads)
+    - get_generic_sequence_by_alignment (one read at a time)
+    - count_sequence_tree, and count_sequence_tree_parallel with --processes
+
+Checked:
+    - the generic sequences of the first --reference-reads reads are the same
+      as with the original Aligner-based get_generic_sequence_by_alignment
+      (reference_generic_sequence), one read at a time and in batches
+    - the counts of count_sequence_tree are the same as counting the reference
+      generic sequences
+
+The timings, the checks and the configuration are saved as JSON in the results
+directory ([results directory]/[commit]_data.json), and --compare prints the
+reads per second of every saved result side by side.
+'''
+import argparse
+import glob
+import json
+import os
+import random
+import subprocess
+import time
+from cStringIO import StringIO
+
+import numpy as np
+
+import count_sequences as cs
+import stat_collector as sc
+from aligner import Aligner, NON_SCORED_TOKENS, VARIABLE_REGION_TOKEN, GENERIC_SEQUENCE_TOKEN
+
+# Bases before the template in the real reads
+READ_PREFIX = 'AGTCATCGC'
+BASES = 'ACGT'
+RESULTS_DIRECTORY = "./benchmark_results"
+
+def synthetic_library(template, library_size, rng):
+    '''
+    Returns library_size distinct variants of template, where every
+    VARIABLE_REGION_TOKEN is replaced with a base. The third base of each codon
+    is G or T (NNK codons).
+    '''
+    library = []
+    seen = set()
+    while len(library) < library_size:
+        variant = ''.join([rng.choice('GT' if i % 3 == 2 else BASES) if c == VARIABLE_REGION_TOKEN else c
+                           for i, c in enumerate(template)])
+        if variant not in seen:
+            seen.add(variant)
+            library.append(variant)
+    return library
+
+def synthetic_reads(template, num_reads, library_size=10000, skew=1.0, mismatch_rate=0.005, n_rate=0.001, seed=0):
+    '''
+    Returns a list of num_reads synthetic reads drawn from a library of variants
+    of template (see the module docstring).
+    '''
+    rng = random.Random(seed)
+    library = synthetic_library(template, library_size, rng)
+    weights = 1.0 / np.arange(1, library_size + 1) ** skew
+    draws = np.random.RandomState(seed).choice(library_size, size=num_reads, p=weights / weights.sum())
+    reads = []
+    for index in draws.tolist():
+        read = list(READ_PREFIX + library[index])
+        for i in xrange(len(read)):
+            x = rng.random()
+            if x < mismatch_rate:
+                read[i] = rng.choice(BASES)
+            elif x < mismatch_rate + n_rate:
+                read[i] = 'N'
+        reads.append(''.join(read))
+    return reads
+
+def reference_generic_sequence(sequence, template, output_template):
+    '''
+    The original get_generic_sequence_by_alignment, which aligns one read at a
+    time with Aligner. Returns (generic sequence or None, score).
+    '''
+    aligner = Aligner(different_score=0)
+    offset, score = aligner.align(sequence, template, min_overlap=len(template))
+    num_matching_bases = len([c for c in template if c not in NON_SCORED_TOKENS])
+    if score < num_matching_bases - cs.DISCARD_THRESHOLD:
+        return None, score
+
+    ret = ""
+    ret_start = 0
+    for i, (base_1, base_2) in enumerate(aligner.enumerate(sequence, output_template, offset)):
+        if base_2 == VARIABLE_REGION_TOKEN:
+            if len(ret) == 0:
+                ret_start = i
+            else:
+                while len(ret) < i - ret_start:
+                    ret += GENERIC_SEQUENCE_TOKEN
+            ret += base_1
+    return ret, score
+
+def reset_caches():
+    # So that every benchmark starts from an empty read cache
+    cs.TEMPLATE_MATCHERS.clear()
+    cs.READ_CACHES.clear()
+    sc.reset()
+
+def timed(function, repeat):
+    '''
+    Returns (best time in seconds, return value of the last call) of calling
+    function repeat times, with empty caches before every call.
+    '''
+    best = None
+    result = None
+    for _ in xrange(repeat):
+        reset_caches()
+        start = time.time()
+        result = function()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+def tree_counts(tree, path=()):
+    '''
+    Returns a dictionary of the count of every key path in a tree returned by
+    count_sequence_tree.
+    '''
+    counts = {}
+    for key, value in tree.items():
+        if type(value) is list:
+            counts[path + (key,)] = value[0]
+            counts.update(tree_counts(value[1], path + (key,)))
+        else:
+            counts[path + (key,)] = value
+    return counts
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run(args):
+    template, output_template = cs.SORTING_TASKS[0]
+    task = cs.SORTING_TASKS[0]
+    reads = synthetic_reads(template, args.reads, library_size=args.library_size, skew=args.skew,
+                            mismatch_rate=args.mismatch_rate, n_rate=args.n_rate, seed=args.seed)
+    text = '\n'.join(reads) + '\n'
+    results = {}
+    checks = {}
+
+    def record(name, seconds, num_reads):
+        results[name] = {"seconds": seconds, "reads": num_reads, "reads_per_second": num_reads / seconds if seconds > 0 else None}
+        print("{:<40} {:>10.3f} s {:>12.0f} reads/s".format(name, seconds, results[name]["reads_per_second"] or 0))
+
+    # Reference: Aligner.align on a subset, which is also what the fast paths are checked against
+    subset = reads[:args.reference_reads]
+    aligner = Aligner(different_score=0)
+    seconds, _ = timed(lambda: [aligner.align(read, template, min_overlap=len(template)) for read in subset], 1)
+    record("Aligner.align", seconds, len(subset))
+    seconds, reference = timed(lambda: [reference_generic_sequence(read, template, output_template) for read in subset], 1)
+    record("reference_generic_sequence", seconds, len(subset))
+
+    seconds, generics = timed(lambda: [cs.get_generic_sequence_by_alignment(read, template, output_template) for read in reads], args.repeat)
+    record("get_generic_sequence_by_alignment", seconds, len(reads))
+    checks["get_generic_sequence_by_alignment"] = generics[:len(subset)] == [generic for generic, _ in reference]
+
+    reset_caches()
+    batch_generics = cs.get_generic_sequences(subset, task)
+    checks["get_generic_sequences"] = batch_generics == [generic for generic, _ in reference]
+
+    # The reference counts are made from the generic sequences of every read,
+    # which get_generic_sequence_by_alignment was just checked to give
+    reference_counts = {}
+    for generic in generics:
+        if generic is not None:
+            reference_counts[(generic,)] = reference_counts.get((generic,), 0) + 1
+
+    seconds, tree = timed(lambda: cs.count_sequence_tree(StringIO(text), [task]), args.repeat)
+    record("count_sequence_tree", seconds, len(reads))
+    checks["count_sequence_tree"] = tree_counts(tree) == reference_counts
+
+    if args.processes > 1:
+        path = os.path.join(args.results, "benchmark_reads.tmp")
+        with open(path, 'w') as file:
+            file.write(text)
+        try:
+            seconds, parallel_tree = timed(lambda: cs.count_sequence_tree_parallel(path, [task], args.processes), args.repeat)
+        finally:
+            os.remove(path)
+        record("count_sequence_tree_parallel", seconds, len(reads))
+        checks["count_sequence_tree_parallel"] = tree_counts(parallel_tree) == reference_counts
+
+    for name, ok in sorted(checks.items()):
+        print("check {:<40} {}".format(name, "OK" if ok else "DIFFERENT"))
+
+    return {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": vars(args),
+        "results": results,
+        "checks": checks,
+    }
+
+def compare(results_directory):
+    '''
+    Prints the reads per second of each benchmark for every saved result.
+    '''
+    saved = []
+    for path in glob.glob(os.path.join(results_directory, "*_data.json")):
+        with open(path) as file:
+            saved.append(json.load(file))
+    saved.sort(key=lambda result: result["date"])
+    names = sorted(set(name for result in saved for name in result["results"]))
+    print("{:<40}".format("reads/s") + "".join(["{:>14}".format(result["commit"]) for result in saved]))
+    for name in names:
+        row = [result["results"].get(name, {}).get("reads_per_second") for result in saved]
+        print("{:<40}".format(name) + "".join(["{:>14}".format("-" if x is None else "{:.0f}".format(x)) for x in row]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks read counting on synthetic reads and checks the fast paths against the reference alignment.')
+    parser.add_argument('--reads', type=int, default=200000,
+                        help='The number of synthetic reads')
+    parser.add_argument('--library-size', type=int, default=20000,
+                        help='The number of distinct variants the reads are drawn from')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='The variant of rank r is drawn with a weight of 1 / r ** skew')
+    parser.add_argument('--mismatch-rate', type=float, default=0.005,
+                        help='The probability that a base is replaced with a random base')
+    parser.add_argument('--n-rate', type=float, default=0.001,
+                        help='The probability that a base is replaced with N')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The random seed')
+    parser.add_argument('--reference-reads', type=int, default=5000,
+                        help='The number of reads aligned with the (slow) reference Aligner')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Each benchmark is run this many times and the best time is kept')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='Also benchmark count_sequence_tree_parallel with this many processes')
+    parser.add_argument('--results', type=str, default=RESULTS_DIRECTORY,
+                        help='The directory the results are saved in')
+    parser.add_argument('--compare', action='store_true',
+                        help='Print the saved results side by side instead of running the benchmarks')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.results)
+    else:
+        if not os.path.exists(args.results):
+            os.mkdir(args.results)
+        result = run(args)
+        out_path = os.path.join(args.results, "{}_data.json".format(result["commit"]))
+        with open(out_path, 'w') as file:
+            json.dump(result, file, indent=2, sort_keys=True)
+        print("results saved to {}".format(out_path))
@@ -35,15 +35,26 @@ import os, sys
 import stat_collector as sc
 import time
 import argparse
+import multiprocessing
+import numpy as np
+from cStringIO import StringIO
 
 # =========== added by Jackson =======================
 # FYI, it's best to never import like this (import *)
 # it can cause some confusion to other people reading code
 # ====================================================
 from aligner import *
+from template_matcher import TemplateMatcher
+from read_cache import LRUCache
+from packed_sequences import SequencePacker, PackedCounter, MAX_PACKED_LENGTH
+import fastq_stream
+import profiler
 
 OUTPUT_DELIMITER = '\t'
+# Extension of the binary count table written next to the text output with --npz
+COUNT_TABLE_EXTENSION = ".npz"
 STAT_SCORES = "scores"
+STAT_CACHE = "cache"
 
 '''
 If the score of the alignment is less than the length of the template minus
@@ -51,6 +62,49 @@ this amount, the sequence will be discarded.
 '''
 DISCARD_THRESHOLD = 2
 
+'''
+Number of lines that are read from the input file and aligned together by the
+TemplateMatcher. Larger batches are faster but use more memory.
+'''
+BATCH_SIZE = 50000
+
+'''
+Maximum number of reads whose generic sequence is remembered (per template), so
+that identical reads are only aligned once. Set to 0 to disable the cache.
+The cache is only used when the reads are not counted with
+count_packed_sequences (see PACK_SEQUENCES), which aligns every batch as a
+matrix instead.
+'''
+CACHE_SIZE = 100000
+
+'''
+When the input is counted with several processes, it is split into this many
+chunks per process, so that a chunk that is slow to count does not hold up the
+others for long.
+'''
+CHUNKS_PER_PROCESS = 4
+
+'''
+If True, a single alignment task whose output template is one run of
+VARIABLE_REGION_TOKEN (of at most MAX_PACKED_LENGTH bases) is counted with
+count_packed_sequences, which packs every generic sequence into a 64-bit
+integer and counts them with array operations. The counts are the same.
+It does not use the read cache (CACHE_SIZE). --no-pack sets it to False.
+'''
+PACK_SEQUENCES = True
+
+# TemplateMatchers and read caches that have been built so far, by template
+TEMPLATE_MATCHERS = {}
+READ_CACHES = {}
+
+# Histogram of the alignment scores, incremented for every aligned read
+SCORE_COUNTS = sc.histogram(STAT_SCORES)
+
+# Stages whose time, reads and memory use are written to the profile JSON file
+READING = profiler.Stage("reading")
+ALIGNMENT = profiler.Stage("alignment")
+COUNTING = profiler.Stage("counting")
+WRITING = profiler.Stage("writing")
 
 
 ''' SORTING_TASKS
@@ -111,64 +165,220 @@ This means that all of the sequence that matches the template will be exported
 List of expression strings which will be evaluated and written out to the
 params.txt file.
 '''
-PARAMETER_LIST = ["args.input", "args.output", "args.complete", "SORTING_TASKS", "DISCARD_THRESHOLD"]
+PARAMETER_LIST = ["args.input", "args.output", "args.complete", "args.fastq", "args.min_average_quality", "args.processes", "args.profile_alignment", "SORTING_TASKS", "DISCARD_THRESHOLD", "CACHE_SIZE", "PACK_SEQUENCES", "args.npz"]
 
-def count_unique_sequences(input_file, match_task, indexes=None):
+def count_sequence_tree(input_file, match_tasks, new_keys=None):
     '''
-    If indexes is None, returns two items. First, a dictionary where each key
-    corresponds to a set of sequences with the same nucleotides at the given
-    position, and the value is a list of indexes in input_file where those
-    sequences may be found. Second, the length of the file in lines.
-    input_file may be any iterable of strings.
-
-    If indexes is not None, it should be a list of the same length as the number
-    of lines in the input. The return value in this case, will be a dictionary where
-    each key is one of the values of the indexes list. The value at that key will
-    be the unique sequences for all lines that have that given index value.
-
-    Added by Jackson:
-    match_task = one of the elements of the SORTING_TASKS list. Should be a tuple
-    input_file = merged read sequences (ex. dnaframe)
+    Counts the sequences for all of match_tasks in a single pass over input_file,
+    and returns them as a tree of nested dictionaries. The keys of the top-level
+    dictionary are the sequences found with the first task. For every task but
+    the last, the value is a list [count, children], where count is the number of
+    lines with that sequence and children is a dictionary of the same form for
+    the next task, built only from those lines. For the last task the value is
+    just the count.
+
+    The sequences for a task are only extracted from lines that had a sequence
+    for all of the previous tasks, as in the original one-pass-per-level method.
+
+    If new_keys is a list, the key path (a tuple of sequences from the top level
+    down) of every entry is appended to it when the entry is created, so that
+    trees counted separately can be merged in the order of first occurrence.
     '''
+    matcher = get_packed_matcher(match_tasks)
+    if matcher is not None:
+        return count_packed_sequences(input_file, matcher, new_keys=new_keys)
+    if hasattr(input_file, 'seek'):
+        input_file.seek(0)
+    tree = {}
+    last_level = len(match_tasks) - 1
+    for _, lines in READING.iterate(read_batches(input_file)):
+        READING.reads.add(len(lines))
+        nodes = [tree] * len(lines)
+        paths = [()] * len(lines)
+        for level, match_task in enumerate(match_tasks):
+            with ALIGNMENT:
+                generics = get_generic_sequences(lines, match_task)
+            ALIGNMENT.reads.add(len(lines))
+            ALIGNMENT.discarded.add(generics.count(None))
+            if level == last_level:
+                with COUNTING:
+                    for node, path, generic in zip(nodes, paths, generics):
+                        if generic is None:
+                            continue
+                        if generic in node:
+                            node[generic] += 1
+                        else:
+                            node[generic] = 1
+                            if new_keys is not None:
+                                new_keys.append(path + (generic,))
+                COUNTING.reads.add(len(generics) - generics.count(None))
+                break
+
+            with COUNTING:
+                next_lines = []
+                next_nodes = []
+                next_paths = []
+                for line, node, path, generic in zip(lines, nodes, paths, generics):
+                    if generic is None:
+                        continue
+                    if generic in node:
+                        entry = node[generic]
+                        entry[0] += 1
+                    else:
+                        entry = node[generic] = [1, {}]
+                        if new_keys is not None:
+                            new_keys.append(path + (generic,))
+                    next_lines.append(line)
+                    next_nodes.append(entry[1])
+                    if new_keys is not None:
+                        next_paths.append(path + (generic,))
+            lines = next_lines
+            nodes = next_nodes
+            paths = next_paths if new_keys is not None else [()] * len(lines)
+    return tree
+
+def get_packed_matcher(match_tasks):
+    '''
+    Returns the TemplateMatcher of match_tasks if they can be counted with
+    count_packed_sequences (see PACK_SEQUENCES), or None.
+    '''
+    if not PACK_SEQUENCES or len(match_tasks) != 1 or type(match_tasks[0][0]) is not str:
+        return None
+    matcher = get_template_matcher(match_tasks[0][0], match_tasks[0][1])
+    if not matcher.output_is_contiguous or matcher.output_end - matcher.output_start > MAX_PACKED_LENGTH:
+        return None
+    return matcher
 
-    input_file.seek(0)
-    ret = {}
-    num_lines = 0
-    for i, line in enumerate(input_file):
-        num_lines = i
-
-        if indexes is not None:
-            if indexes[i] is None:
-                continue
-            if indexes[i] not in ret:
-                ret[indexes[i]] = {}
-            ret_to_write = ret[indexes[i]]
-        else:
-            ret_to_write = ret
-
-        if type(match_task[0]) is str:
-            # Align the match_task template
-
-            # ======= added by Jackson ===============
-            # get_generic_sequence_by_alignment arguments:
-            # sequence = line.strip() - single merged read
-            # template = match_task[0]
-            # output_template = match_task[1]
-            # generic = output string of matching section of read using output_template
-            # =========================================
-            generic = get_generic_sequence_by_alignment(line.strip(), match_task[0], match_task[1])
-        else:
-            # Use the bases at the given positions
-            generic = get_generic_sequence_by_position(line.strip(), [match_task])
-        if generic is None:
-            continue
-
-        if generic in ret_to_write:
-            ret_to_write[generic].add(i)
+def count_packed_sequences(input_file, matcher, new_keys=None):
+    '''
+    Same as count_sequence_tree for a single alignment task, but the whole batch
+    is aligned with matcher, the generic sequences are cut out of the read matrix
+    and packed into 64-bit integers, and they are counted with a PackedCounter.
+    The sequences are only turned back into strings for the returned dictionary,
+    whose keys are added in order of first occurrence as in count_sequence_tree.
+    '''
+    if hasattr(input_file, 'seek'):
+        input_file.seek(0)
+    counter = PackedCounter(SequencePacker(matcher.output_end - matcher.output_start))
+    for start, lines in READING.iterate(read_batches(input_file)):
+        READING.reads.add(len(lines))
+        with ALIGNMENT:
+            matrix, lengths = matcher.read_matrix(lines)
+            offsets, scores, alignable = matcher.align_arrays(matrix, lengths)
+            kept = np.flatnonzero(alignable & (scores >= matcher.num_matching_bases - matcher.discard_threshold))
+            generics = matcher.extract_matrix(matrix, kept, offsets[kept])
+        ALIGNMENT.reads.add(len(lines))
+        ALIGNMENT.discarded.add(len(lines) - len(kept))
+        values, counts = np.unique(scores[alignable], return_counts=True)
+        SCORE_COUNTS.update(dict(zip(values.tolist(), counts.tolist())))
+        if not alignable.all():
+            SCORE_COUNTS.add(NO_SCORE, len(lines) - int(alignable.sum()))
+        with COUNTING:
+            counter.add(generics, start + kept)
+        COUNTING.reads.add(len(kept))
+
+    with COUNTING:
+        tree = {}
+        for generic, count in counter.items():
+            tree[generic] = count
+            if new_keys is not None:
+                new_keys.append((generic,))
+    return tree
+
+def merge_sequence_trees(tree, other, other_new_keys, num_levels):
+    '''
+    Adds the counts of the sequence tree other to tree (both made by
+    count_sequence_tree with num_levels tasks). other_new_keys is the list of key
+    paths of other in the order they were created. Entries that tree does not
+    have yet are created in that order, so merging the trees of consecutive parts
+    of a file in order gives the same dictionaries as counting the whole file.
+    '''
+    for path in other_new_keys:
+        node = tree
+        for key in path[:-1]:
+            node = node[key][1]
+        if path[-1] not in node:
+            node[path[-1]] = 0 if len(path) == num_levels else [0, {}]
+    _add_tree_counts(tree, other)
+
+def _add_tree_counts(tree, other):
+    for key, value in other.iteritems():
+        if type(value) is int:
+            tree[key] += value
         else:
-            ret_to_write[generic] = set([i])
+            tree[key][0] += value[0]
+            _add_tree_counts(tree[key][1], value[1])
 
-    return ret, num_lines + 1
+def file_chunks(path, num_chunks):
+    '''
+    Returns a list of (start, end) byte ranges that split the file at path into
+    at most num_chunks parts of about the same size, each ending at the end of
+    a line.
+    '''
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as file:
+        for i in xrange(1, num_chunks):
+            file.seek(size * i // num_chunks)
+            file.readline()
+            position = file.tell()
+            if boundaries[-1] < position < size:
+                boundaries.append(position)
+    boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+def count_chunk(args):
+    '''
+    Counts the lines in the byte range [start, end) of the file at path with
+    count_sequence_tree. Run in a worker process by count_sequence_tree_parallel,
+    so it takes a single (path, start, end, match_tasks) tuple and returns the
+    tree, its new_keys list and the statistics collected for the chunk.
+    '''
+    path, start, end, match_tasks = args
+    sc.reset()
+    with open(path, 'rb') as file:
+        file.seek(start)
+        chunk = StringIO(file.read(end - start))
+    new_keys = []
+    tree = count_sequence_tree(chunk, match_tasks, new_keys=new_keys)
+    for cache in READ_CACHES.values():
+        cache.report(STAT_CACHE)
+    return tree, new_keys, sc.snapshot()
+
+def count_sequence_tree_parallel(path, match_tasks, processes):
+    '''
+    Same as count_sequence_tree for the file at path, but the file is split into
+    chunks that are counted by a pool of processes. The trees of the chunks are
+    merged in file order, so the result is the same as counting the whole file
+    at once. The statistics of the chunks are added to the stat collector.
+    '''
+    chunks = [(path, start, end, match_tasks) for start, end in file_chunks(path, processes * CHUNKS_PER_PROCESS)]
+    tree = {}
+    pool = multiprocessing.Pool(processes)
+    try:
+        for chunk_tree, new_keys, statistics in pool.imap(count_chunk, chunks):
+            merge_sequence_trees(tree, chunk_tree, new_keys, len(match_tasks))
+            sc.merge(statistics)
+    finally:
+        pool.close()
+        pool.join()
+    return tree
+
+def read_batches(input_file, batch_size=BATCH_SIZE):
+    '''
+    Yields (start, lines) for consecutive batches of up to batch_size stripped
+    lines from input_file, where start is the index of the first line in the batch.
+    '''
+    start = 0
+    lines = []
+    for line in input_file:
+        lines.append(line.strip())
+        if len(lines) == batch_size:
+            yield start, lines
+            start += len(lines)
+            lines = []
+    if len(lines) > 0:
+        yield start, lines
 
 def get_generic_sequence_by_position(sequence, match_ranges):
     '''
@@ -187,6 +397,44 @@ def get_generic_sequence_by_position(sequence, match_ranges):
         ret += sequence[start:end]
     return ret
 
+def get_generic_sequences(sequences, match_task):
+    '''
+    Returns the generic sequence (or None) of each of the given sequences for one
+    of the SORTING_TASKS.
+    '''
+    if type(match_task[0]) is str:
+        # Align the match_task template to the whole batch at once. This gives
+        # the same results as calling get_generic_sequence_by_alignment on each
+        # sequence.
+        matcher = get_template_matcher(match_task[0], match_task[1])
+        cache = get_read_cache(match_task[0], match_task[1])
+        return get_generic_sequences_by_alignment(sequences, matcher, cache=cache)
+    # Use the bases at the given positions
+    return [get_generic_sequence_by_position(sequence, [match_task]) for sequence in sequences]
+
+def get_template_matcher(template, output_template):
+    '''
+    Returns the TemplateMatcher for the given template and output template,
+    creating it the first time it is needed.
+    '''
+    key = (template, output_template, DISCARD_THRESHOLD)
+    if key not in TEMPLATE_MATCHERS:
+        TEMPLATE_MATCHERS[key] = TemplateMatcher(template, output_template, DISCARD_THRESHOLD)
+    return TEMPLATE_MATCHERS[key]
+
+def get_read_cache(template, output_template):
+    '''
+    Returns the LRUCache of (generic sequence, score) by read for the given
+    template and output template, creating it the first time it is needed.
+    Returns None if CACHE_SIZE is 0.
+    '''
+    if CACHE_SIZE <= 0:
+        return None
+    key = (template, output_template, DISCARD_THRESHOLD)
+    if key not in READ_CACHES:
+        READ_CACHES[key] = LRUCache(CACHE_SIZE)
+    return READ_CACHES[key]
+
 def get_generic_sequence_by_alignment(sequence, template, output_template):
     '''
     Returns a generic sequence by aligning template to sequence, and including
@@ -194,30 +442,68 @@ def get_generic_sequence_by_alignment(sequence, template, output_template):
 
     For example, if the sequence were ABCDEFGH and the template were AB**E*, the
     returned generic sequence would be 'CD.F'.
+
+    The template is located with the anchor index of a TemplateMatcher, which
+    gives the same offset and score as Aligner.align(sequence, template,
+    min_overlap=len(template)) with different_score=0.
     '''
-    aligner = Aligner(different_score=0)
-    offset, score = aligner.align(sequence, template, min_overlap=len(template))
-    num_matching_bases = len([c for c in template if c not in NON_SCORED_TOKENS])
-    sc.counter(1, STAT_SCORES, score)
-    if score < num_matching_bases - DISCARD_THRESHOLD:
-        return None
+    cache = get_read_cache(template, output_template)
+    cached = cache.get(sequence) if cache is not None else None
+    if cached is None:
+        cached = get_template_matcher(template, output_template).generic_sequence(sequence)
+        if cache is not None:
+            cache.put(sequence, cached)
+    generic, score = cached
+    SCORE_COUNTS.add(score)
+    return generic
+
+def get_generic_sequences_by_alignment(sequences, matcher, cache=None):
+    '''
+    Batch version of get_generic_sequence_by_alignment. Returns a list with the
+    generic sequence (or None) for each sequence in sequences, using the given
+    TemplateMatcher to align all of them at once.
 
-    ret = ""
-    ret_start = 0
-    # =============== added by Jackson ===========================================
-    # the below loop just exports the aligning region according to output_template
-    # ============================================================================
-    for i, (base_1, base_2) in enumerate(aligner.enumerate(sequence, output_template, offset)):
-        if base_2 == VARIABLE_REGION_TOKEN:
-            if len(ret) == 0:
-                ret_start = i
-            else:
-                while len(ret) < i - ret_start:
-                    ret += GENERIC_SEQUENCE_TOKEN
-            ret += base_1
-    return ret
+    If cache is not None, it should be an LRUCache of (generic sequence, score)
+    by sequence. Only the sequences that are not in the cache are aligned, each
+    of them once, and their results are added to the cache.
+    '''
+    if cache is None:
+        results = zip(*matcher.generic_sequences(sequences))
+    else:
+        results = []
+        missing = {}
+        for sequence in sequences:
+            if sequence in missing:
+                # Repeats of a missing sequence within the batch are served by
+                # the alignment of its first occurrence
+                cache.hits += 1
+                results.append(None)
+                continue
+            result = cache.get(sequence)
+            if result is None:
+                missing[sequence] = None
+            results.append(result)
+        missing_sequences = list(missing)
+        for sequence, result in zip(missing_sequences, zip(*matcher.generic_sequences(missing_sequences))):
+            missing[sequence] = result
+            cache.put(sequence, result)
+        results = [missing[sequence] if result is None else result for sequence, result in zip(sequences, results)]
+    score_counts = {}
+    for generic, score in results:
+        score_counts[score] = score_counts.get(score, 0) + 1
+    SCORE_COUNTS.update(score_counts)
+    return [generic for generic, score in results]
+
+def num_reads(node):
+    '''
+    Returns the number of reads for a value of the tree returned by
+    count_sequence_tree (a [count, children] list, or a count for the last task).
+    '''
+    if type(node) is list:
+        return node[0]
+    return node
 
-def write_hierarchical_unique_sequences(in_file, match_ranges, out_file, indent=0, complete_file=None, uniques=None, file_length=None):
+def write_hierarchical_unique_sequences(in_file, match_ranges, out_file, indent=0, complete_file=None, uniques=None):
     '''
     Groups the file in_file by the first match range, then each group by the
     second match range, and so on. Writes the distribution of each match to
@@ -226,71 +512,101 @@ def write_hierarchical_unique_sequences(in_file, match_ranges, out_file, indent=
     By default, the last group's keys will not be written to file. If desired,
     specify complete_file to write those keys in another hierarchical level to a
     separate file.
+
+    All of the groups are counted in one pass over in_file with
+    count_sequence_tree. If uniques is given, it should be such a tree for
+    match_ranges, and in_file is not read at all.
     '''
     if len(match_ranges) == 0:
         return
     if uniques is None:
-        uniques, file_length = count_unique_sequences(in_file, match_ranges[0])
-
-    sorted_uniques = sorted(uniques.items(), reverse=True, key=lambda x: len(x[1]))
-
-    if len(match_ranges) > 1:
-        # Precompute the unique matches for the next match range to get the
-        # number of unique items within each match at this round
-        index_list = [None for _ in xrange(file_length)]
-        for i, (match, indexes) in enumerate(sorted_uniques):
-            for index in indexes:
-                index_list[index] = i
-        new_uniques, _ = count_unique_sequences(in_file, match_ranges[1], indexes=index_list)
-    else:
-        new_uniques = None
-
-    # ================== added by Jackson ================================================
-    # indexing is very confusing in loop below
-    # it accesses next level matches by using i
-    # enumerates `sorted_uniques` to get counts for first level sequences
-    # `new_uniques` is created by enumerating `sorted_uniques` so you can access the correct entry
-    # with `i` in the below script (by enumerating it again)
-    # ====================================================================================
-    for i, (match, indexes) in enumerate(sorted_uniques):
+        uniques = count_sequence_tree(in_file, match_ranges)
+
+    sorted_uniques = sorted(uniques.items(), reverse=True, key=lambda x: num_reads(x[1]))
+
+    # uniques is a tree from count_sequence_tree. For every level but the last,
+    # each value is [count, children], where children are the next level's
+    # sequences for just the reads in this group. For the last level the value
+    # is just the count.
+    for match, node in sorted_uniques:
         if len(match_ranges) > 1:
-            unique_submatches = len(new_uniques[i])
+            # the second number is the number of unique sequences for the next
+            # match range within this group
+            count, submatches = node
+            unique_submatches = len(submatches)
         else:
-            unique_submatches = len(indexes)
+            count = unique_submatches = node
 
-        string_to_write = "\t\t" * indent + OUTPUT_DELIMITER.join([str(len(indexes)), str(unique_submatches), match]) + "\n"
+        string_to_write = "\t\t" * indent + OUTPUT_DELIMITER.join([str(count), str(unique_submatches), match]) + "\n"
 
         if complete_file is not None:
             complete_file.write(string_to_write)
-        
-        # ================== added by Jackson ================================================
-        '''
-        below conditional:
-        runs write_hierarchical_unique_sequences with completely different parameters for just the
-        sequences corresponding to new_uniques[i]. It already has uniques defined as input param
-        so it skips the first call to count_unique_sequences and goes straight to sorting.
-        skips any conditional where len(match_ranges)>1 if it's the last task b/c of the param
-        match_ranges=match_ranges[1:]. It does however write the next line to complete_file
-        because it's now using the complete_file parameter
-        '''
-        # ====================================================================================
+
+        # Write the next level for just the sequences in this group (its counts
+        # are already in submatches). The last level is only written to
+        # complete_file: out_file is the summary of the groups, and complete_file
+        # has every sequence of the last task with its count. With a single
+        # sorting task, the count rows therefore only appear with -c, and
+        # out_file stays empty.
         if len(match_ranges) > 1:
             out_file.write(string_to_write)
-            write_hierarchical_unique_sequences(in_file, match_ranges[1:], out_file, indent=indent + 1, complete_file=complete_file, uniques=new_uniques[i], file_length=file_length)
+            write_hierarchical_unique_sequences(in_file, match_ranges[1:], out_file, indent=indent + 1, complete_file=complete_file, uniques=submatches)
+
+def write_count_table(uniques, out_path):
+    '''
+    Writes the top level of a tree returned by count_sequence_tree to a numpy
+    .npz file with two columns: "count" (int64) and "seq" (fixed width bytes),
+    in the same order as write_hierarchical_unique_sequences writes them. With a
+    single sorting task, this is the same table as the complete file, and it
+    can be loaded without parsing any text.
+    '''
+    sorted_uniques = sorted(uniques.items(), reverse=True, key=lambda x: num_reads(x[1]))
+    counts = np.array([num_reads(node) for _, node in sorted_uniques], dtype=np.int64)
+    seqs = np.array([match for match, _ in sorted_uniques], dtype=np.string_)
+    if len(seqs) == 0:
+        seqs = seqs.astype('S1')
+    np.savez(out_path, count=counts, seq=seqs)
 
 ### Main function
 
-def main_count_sequences(input, output, tasks, complete_path=None):
+def main_count_sequences(input, output, tasks, complete_path=None, fastq=False, min_average_quality=fastq_stream.MIN_AVERAGE_QUALITY, processes=1, profile_alignment=None, npz=False):
     ''' added by Jackson 
     This function generates output files and opens input file (merged reads)
     It then passes files and tasks parameters to `write_hierarchical_unique_sequences`
     input = merged read sequences (ex. dnaframe)
     output = sequence counts output directory
     '''
+    # If fastq is True, input is instead an interleaved FASTQ file (optionally
+    # gzipped). Its forward reads are quality filtered and counted as they are
+    # read, without writing the _f.fq, _r.fq and _f_nts_only files, and the
+    # output files are named after the _f_nts_only file that would have been
+    # counted.
+    #
+    # If processes is more than 1 (and fastq is False), the input file is split
+    # into chunks that are counted in parallel.
+    #
+    # The time, reads and peak memory use of each stage are written to
+    # [output]/[basename]_profile.json. If profile_alignment is a path, the
+    # alignment is also run under cProfile and its statistics are written there.
+    #
+    # If npz is True, the counts are also written as a binary table (see
+    # write_count_table) to [basename].npz, in the complete_path directory if it
+    # is given or in output otherwise.
+    if profile_alignment is not None:
+        ALIGNMENT.enable_cprofile()
     if not os.path.exists(output):
         os.mkdir(output)
-    basename = os.path.basename(input)
-    with open(input, 'r') as file, open(os.path.join(output, basename), 'w') as out_file:
+    if fastq:
+        basename = fastq_stream.counts_basename(input)
+        uniques = count_sequence_tree(fastq_stream.forward_reads(input, min_average_quality=min_average_quality), tasks)
+    elif processes > 1:
+        basename = os.path.basename(input)
+        uniques = count_sequence_tree_parallel(input, tasks, processes)
+    else:
+        basename = os.path.basename(input)
+        with open(input, 'r') as file:
+            uniques = count_sequence_tree(file, tasks)
+    with WRITING, open(os.path.join(output, basename), 'w') as out_file:
         if complete_path is not None:
             if not os.path.exists(complete_path):
                 os.mkdir(complete_path)
@@ -298,16 +614,24 @@ def main_count_sequences(input, output, tasks, complete_path=None):
         else:
             complete_file = None
         ''' added by Jackson 
-        file = input file - merged read sequences (dnaframe)
         out_file = sequence counts output file
         complete_file = complete sequence counts output file
         '''
-        write_hierarchical_unique_sequences(file, tasks, out_file, complete_file=complete_file)
+        write_hierarchical_unique_sequences(None, tasks, out_file, complete_file=complete_file, uniques=uniques)
 
         if complete_file is not None:
             complete_file.close()
+        if npz:
+            table_directory = complete_path if complete_path is not None else output
+            write_count_table(uniques, os.path.join(table_directory, basename + COUNT_TABLE_EXTENSION))
 
+    for cache in READ_CACHES.values():
+        cache.report(STAT_CACHE)
+    profile = sc.StatCollector().statistics.pop(profiler.STAT_PROFILE, {})
     sc.write(os.path.join(output, "stats"), prefix=basename)
+    profiler.write_json(os.path.join(output, basename + "_" + profiler.PROFILE_NAME), profile)
+    if profile_alignment is not None:
+        ALIGNMENT.write_cprofile(profile_alignment)
 
 if __name__ == '__main__':
     a = time.time()  # Time the script started
@@ -318,9 +642,28 @@ if __name__ == '__main__':
                         help='The path to the output directory')
     parser.add_argument('-c', '--complete', type=str, default=None,
                         help='The path to an additional output directory for the complete set of unique sequences')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='The number of distinct reads whose alignment result is cached (0 to disable). '
+                             'Only used when the reads are not packed (--no-pack, or sorting tasks that can\'t be packed)')
+    parser.add_argument('--no-pack', action='store_true',
+                        help='Don\'t count a single sorting task with packed 2-bit sequences (see PACK_SEQUENCES), so that the reads go through the read cache')
+    parser.add_argument('--fastq', action='store_true',
+                        help='The input file is an interleaved FASTQ file (optionally gzipped), whose forward reads are quality filtered and counted directly')
+    parser.add_argument('--min-average-quality', type=float, default=fastq_stream.MIN_AVERAGE_QUALITY,
+                        help='With --fastq, pairs where either read has a lower average quality are discarded (like reformat.sh minavgquality)')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='The number of processes that count chunks of the input file in parallel (not used with --fastq)')
+    parser.add_argument('--profile-alignment', type=str, default=None,
+                        help='Run the alignment under cProfile and write its statistics to this path (only with -p 1)')
+    parser.add_argument('--npz', action='store_true',
+                        help='Also write the counts as a binary table ([name].npz) that the analysis scripts load without parsing text')
     args = parser.parse_args()
+    if args.profile_alignment is not None and args.processes > 1:
+        parser.error('--profile-alignment can only be used with -p 1')
+    CACHE_SIZE = args.cache_size
+    PACK_SEQUENCES = not args.no_pack
 
-    main_count_sequences(args.input, args.output, SORTING_TASKS, complete_path=args.complete)
+    main_count_sequences(args.input, args.output, SORTING_TASKS, complete_path=args.complete, fastq=args.fastq, min_average_quality=args.min_average_quality, processes=args.processes, profile_alignment=args.profile_alignment, npz=args.npz)
 
     b = time.time()
     print("Took {} seconds to execute.".format(b - a))
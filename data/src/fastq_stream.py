@@ -0,0 +1,193 @@
+'''
+Streams the forward reads out of an interleaved FASTQ file (optionally gzipped)
+without writing any intermediate files. It replaces the two steps that
+main_process_and_count_barcodes.py otherwise runs before counting:
+
+    reformat.sh in=barcode_x out1=barcode_x_f.fq out2=barcode_x_r.fq minavgquality=20
+    python fq2str.py barcode_x_f.fq
+
+and yields the same sequences, in the same order, that those steps write to
+barcode_x_f_nts_only.
+
+The quality filter follows reformat.sh: the average quality of a read is the
+Phred score of the mean error probability of its bases, bases that are not
+A/C/G/T (such as N) are left out of the average, and a pair is discarded if
+either read is below minavgquality.
+
+Usage:
+>>> for sequence in forward_reads("barcode_0"):
+...     print(sequence)
+
+Records are expected to take 4 lines each, as written by Illumina instruments.
+The file is read in large blocks and parsed in batches: the quality strings of a
+batch are decoded into a NumPy array and the average quality of every read is
+computed with array operations, so no object is created per record.
+'''
+import gzip
+import math
+import os
+
+import numpy as np
+
+import stat_collector as sc
+
+PHRED_OFFSET = 33
+MIN_AVERAGE_QUALITY = 20
+DEFINED_BASES = set('ACGTacgt')
+STAT_QUALITY = "quality_filter"
+
+READ_BLOCK_SIZE = 1 << 22
+PAD_BYTE = '\0'
+
+# Error probability for each quality character
+ERROR_PROBABILITIES = dict((chr(q + PHRED_OFFSET), 10 ** (-q / 10.0)) for q in xrange(127 - PHRED_OFFSET))
+
+# The same lookups as arrays indexed by byte value, for batches of reads
+ERROR_PROBABILITY_TABLE = np.zeros(256)
+for character, probability in ERROR_PROBABILITIES.items():
+    ERROR_PROBABILITY_TABLE[ord(character)] = probability
+DEFINED_BASE_TABLE = np.zeros(256, dtype=bool)
+DEFINED_BASE_TABLE[[ord(base) for base in DEFINED_BASES]] = True
+
+def open_fastq(path):
+    '''
+    Opens a FASTQ file for reading, decompressing it if the name ends in .gz.
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'r')
+
+def counts_basename(path):
+    '''
+    Returns the name of the sequence count file for the given FASTQ file, which
+    is the name of the nucleotide file written by reformat.sh and fq2str.py.
+    '''
+    name = os.path.basename(path)
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    return name + '_f_nts_only'
+
+def read_line_batches(handle, lines_per_group, block_size=READ_BLOCK_SIZE):
+    '''
+    Yields lists of the lines (without line endings) in an open file, reading it
+    in blocks of about block_size bytes. The number of lines in each list is a
+    multiple of lines_per_group, and lines at the end of the file that do not
+    make up a whole group are dropped.
+    '''
+    remainder = ''
+    pending = []
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            break
+        text = remainder + block
+        lines = text.split('\n')
+        remainder = lines.pop()
+        if '\r' in text:
+            lines = [line.rstrip('\r') for line in lines]
+        if len(pending) > 0:
+            lines = pending + lines
+        num_lines = len(lines) - len(lines) % lines_per_group
+        pending = lines[num_lines:]
+        if num_lines > 0:
+            yield lines[:num_lines]
+    if remainder:
+        pending.append(remainder.rstrip('\r'))
+    num_lines = len(pending) - len(pending) % lines_per_group
+    if num_lines > 0:
+        yield pending[:num_lines]
+
+def read_record_batches(handle):
+    '''
+    Yields (sequences, qualities) for batches of records in an open FASTQ file.
+    '''
+    for lines in read_line_batches(handle, 4):
+        yield lines[1::4], lines[3::4]
+
+def read_pair_batches(handle):
+    '''
+    Yields (sequences_1, qualities_1, sequences_2, qualities_2) for batches of
+    pairs of records in an open interleaved FASTQ file.
+    '''
+    for lines in read_line_batches(handle, 8):
+        yield lines[1::8], lines[3::8], lines[5::8], lines[7::8]
+
+def byte_matrix(strings, width):
+    '''
+    Returns a uint8 array with one row per string, padded on the right with
+    PAD_BYTE to the given width.
+    '''
+    if width == 0:
+        return np.zeros((len(strings), 0), dtype=np.uint8)
+    joined = ''.join(strings)
+    if len(joined) != width * len(strings):
+        joined = ''.join([string.ljust(width, PAD_BYTE) for string in strings])
+    return np.frombuffer(joined, dtype=np.uint8).reshape(len(strings), width)
+
+def average_quality(sequence, quality):
+    '''
+    Returns the average quality of a read as computed by reformat.sh, or 0 if
+    the read has no defined bases.
+    '''
+    total = 0.0
+    num_bases = 0
+    for base, q in zip(sequence, quality):
+        if base in DEFINED_BASES:
+            total += ERROR_PROBABILITIES[q]
+            num_bases += 1
+    if num_bases == 0 or total == 0:
+        return 0 if num_bases == 0 else float('inf')
+    return -10 * math.log10(total / num_bases)
+
+def average_qualities(sequences, qualities):
+    '''
+    Returns an array with the average quality of each read, computed as in
+    average_quality but for a whole batch of reads with array operations.
+    '''
+    if len(sequences) == 0:
+        return np.zeros(0)
+    width = max(max([len(sequence) for sequence in sequences]), max([len(quality) for quality in qualities]))
+    sequence_matrix = byte_matrix(sequences, width)
+    quality_matrix = byte_matrix(qualities, width)
+    # Bases past the end of either string are padding, like the bases zip() drops
+    defined = DEFINED_BASE_TABLE[sequence_matrix] & (quality_matrix != ord(PAD_BYTE))
+    errors = np.where(defined, ERROR_PROBABILITY_TABLE[quality_matrix], 0.0).T
+
+    # Add the error probabilities one position at a time (for all reads at once)
+    # so they are summed in the same order as in average_quality
+    total = np.zeros(len(sequences))
+    for column in errors:
+        total += column
+    num_bases = defined.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        averages = -10 * np.log10(total / num_bases)
+    averages[total == 0] = np.inf
+    averages[num_bases == 0] = 0
+    return averages
+
+def forward_read_batches(path, min_average_quality=MIN_AVERAGE_QUALITY):
+    '''
+    Yields lists of the sequences of the forward reads of the pairs in the
+    interleaved FASTQ file at path where both reads pass the quality filter. The
+    number of pairs read and kept is added to the stat collector.
+    '''
+    num_pairs = 0
+    num_passed = 0
+    with open_fastq(path) as handle:
+        for sequences_1, qualities_1, sequences_2, qualities_2 in read_pair_batches(handle):
+            passed = ((average_qualities(sequences_1, qualities_1) >= min_average_quality) &
+                      (average_qualities(sequences_2, qualities_2) >= min_average_quality))
+            num_pairs += len(sequences_1)
+            num_passed += int(passed.sum())
+            yield [sequence for sequence, ok in zip(sequences_1, passed.tolist()) if ok]
+    sc.counter(num_pairs, STAT_QUALITY, "pairs")
+    sc.counter(num_passed, STAT_QUALITY, "passed")
+
+def forward_reads(path, min_average_quality=MIN_AVERAGE_QUALITY):
+    '''
+    Yields the sequence of the forward read of each pair in the interleaved
+    FASTQ file at path where both reads pass the quality filter.
+    '''
+    for sequences in forward_read_batches(path, min_average_quality):
+        for sequence in sequences:
+            yield sequence
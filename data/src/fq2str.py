@@ -1,17 +1,12 @@
-from Bio import SeqIO, Seq
+from fastq_stream import read_record_batches
 import sys
 import os
 Input_name = str(sys.argv[1])
 output_name = os.path.splitext(Input_name)[0] + '_nts_only'
 
 
-seqs = []
+# records are parsed in large batches instead of one SeqRecord at a time
 with open(Input_name) as handle:
-    reads = SeqIO.parse(handle, 'fastq')
-    for read in reads:
-        seqs.append(str(read.seq))
-
-
-with open(output_name, 'w') as output:
-    for seq in seqs:
-        output.write(seq + '\n')
+    with open(output_name, 'w') as output:
+        for seqs, quals in read_record_batches(handle):
+            output.write('\n'.join(seqs) + '\n')
@@ -0,0 +1,116 @@
+'''
+Contains the JobScheduler class, which runs a graph of jobs where each job can
+depend on other jobs and belongs to a stage with its own number of workers.
+
+main_process_and_count_barcodes.py uses it to pipeline the processing of the
+barcode files: each barcode goes through reformat -> fq2str -> count, and a
+barcode can be counted as soon as its own fq2str job is done, while other
+barcodes are still being reformatted.
+
+Usage:
+>>> scheduler = JobScheduler({"reformat": 2, "count": 4})
+>>> scheduler.add(Job("reformat barcode_0", "reformat", run_reformat, ["barcode_0"]))
+>>> scheduler.add(Job("count barcode_0", "count", run_count, ["barcode_0"], dependencies=["reformat barcode_0"]))
+>>> failed = scheduler.run()
+
+Jobs run in threads of the scheduler's process, so they should spend their time
+waiting on subprocesses (or otherwise release the GIL). A job fails if its
+function raises an exception; the jobs that depend on it are then skipped, and
+the other jobs still run.
+'''
+import threading
+import traceback
+from Queue import Queue
+
+EVENT_TIMEOUT = 365 * 24 * 60 * 60
+
+class Job(object):
+
+    def __init__(self, name, stage, function, args=(), dependencies=()):
+        self.name = name
+        self.stage = stage
+        self.function = function
+        self.args = args
+        self.dependencies = list(dependencies)
+
+    def __str__(self):
+        return self.name
+
+class JobScheduler(object):
+
+    def __init__(self, workers, default_workers=1):
+        '''
+        workers is a dictionary of the maximum number of jobs that may run at the
+        same time in each stage. Stages that are not listed get default_workers.
+        '''
+        self.workers = workers
+        self.default_workers = default_workers
+        self.jobs = []
+        self.jobs_by_name = {}
+        self.errors = {}
+
+    def add(self, job):
+        '''
+        Adds a job to the graph. Its dependencies must have been added already.
+        '''
+        assert job.name not in self.jobs_by_name, "Duplicate job name: {}".format(job.name)
+        for dependency in job.dependencies:
+            assert dependency in self.jobs_by_name, "Unknown dependency {} of job {}".format(dependency, job.name)
+        self.jobs.append(job)
+        self.jobs_by_name[job.name] = job
+        return job
+
+    def stage_workers(self, stage):
+        return max(1, self.workers.get(stage, self.default_workers))
+
+    def _run_job(self, job, events):
+        try:
+            job.function(*job.args)
+        except BaseException as e:
+            events.put((job, "{}\n{}".format(e, traceback.format_exc())))
+        else:
+            events.put((job, None))
+
+    def run(self):
+        '''
+        Runs all of the jobs, starting each one as soon as its dependencies are
+        done and its stage has a free worker. Jobs are started in the order they
+        were added. Returns the list of jobs that failed or were skipped because
+        a dependency failed; the error of each failed job is kept in self.errors.
+        '''
+        waiting = list(self.jobs)
+        done = set()
+        failed = []
+        running = {}
+        events = Queue()
+
+        while len(waiting) > 0 or sum(running.values()) > 0:
+            # Skip the jobs that can never run, then start every job that can
+            failed_names = set(job.name for job in failed)
+            for job in list(waiting):
+                if any(dependency in failed_names for dependency in job.dependencies):
+                    waiting.remove(job)
+                    failed.append(job)
+                    failed_names.add(job.name)
+            for job in list(waiting):
+                if running.get(job.stage, 0) >= self.stage_workers(job.stage):
+                    continue
+                if not all(dependency in done for dependency in job.dependencies):
+                    continue
+                waiting.remove(job)
+                running[job.stage] = running.get(job.stage, 0) + 1
+                thread = threading.Thread(target=self._run_job, args=(job, events))
+                thread.daemon = True
+                thread.start()
+
+            if sum(running.values()) == 0:
+                break
+            # A timeout keeps the wait interruptible with Ctrl-C in Python 2
+            job, error = events.get(True, EVENT_TIMEOUT)
+            running[job.stage] -= 1
+            if error is None:
+                done.add(job.name)
+            else:
+                self.errors[job.name] = error
+                failed.append(job)
+        return failed + waiting
@@ -1,9 +1,36 @@
 '''
 Run script with python2
 python main_process_and_count_barcodes.py [barcode_directory] [reformat command]
+or
+python main_process_and_count_barcodes.py [barcode_directory] --stream
 
 barcode_directory = path to fastq files (de-multiplexed files with no extension: `barcode_x`)
 reformat command = file path to bbtools `reformat.sh` executable
+--stream = quality filter, de-interleave and count each fastq file in a single pass
+    (count_sequences.py --fastq) without bbtools and without the intermediate
+    `_f.fq`, `_r.fq` and `_f_nts_only` files. The read count tables are the same.
+--reformat-workers, --fq2str-workers, --count-workers = number of jobs of each stage
+    that may run at the same time (1 by default)
+--count-processes = number of processes used by each count_sequences.py job
+--force = process every barcode, even the ones the manifest says are up to date
+--npz = also save each read count table as a binary table (`barcode_x_f_nts_only.npz`)
+    that the analysis scripts load instead of parsing the text file
+
+Every barcode is processed as its own chain of jobs, so barcode_3 can be counted
+while barcode_0 is still being reformatted. If a command fails, the remaining
+steps for that barcode are skipped, the other barcodes are still processed, and
+the script exits with a nonzero status.
+
+A manifest ([barcode_directory]/sequence_counts/manifest.json) records the hash of
+each barcode's fastq file, the counting parameters (SORTING_TASKS,
+DISCARD_THRESHOLD and the minimum average quality) and the hash of its read count
+table. When the script is rerun, barcodes whose fastq file, parameters and count
+table are unchanged are skipped.
+
+The wall time and peak memory use of every job, and the profile of each
+count_sequences.py run (time, reads and discarded reads of its reading,
+alignment, counting and writing stages), are written by barcode to
+[barcode_directory]/sequence_counts/profile.json.
 
 
 I haven't added much documentation to this b/c it's a pretty short script
@@ -18,37 +45,88 @@ Read count tables (counts for each read) are saved in [barcode_directory]/sequen
 
 import subprocess
 import glob, os
-import multiprocessing
 import sys
+import argparse
+import json
+
+from job_scheduler import Job, JobScheduler
+from manifest import Manifest, MANIFEST_NAME
+import count_sequences
+import fastq_stream
+import profiler
+import stat_collector as sc
 
-# TODO use argparser instead of positional arguments
+STAGE_REFORMAT = "reformat"
+STAGE_FQ2STR = "fq2str"
+STAGE_COUNT = "count"
+STAGE_MANIFEST = "manifest"
 
+MIN_AVERAGE_QUALITY = fastq_stream.MIN_AVERAGE_QUALITY
 
-def run(file, reformat_command):
+
+def run_reformat(file, reformat_command):
     # run BBduk reformat command to quality filter and de-interleave paired reads
-    subprocess.call("{} in={} out1={}_f.fq out2={}_r.fq minavgquality=20".format(reformat_command, file, file, file), shell=True)
+    profiler.check_call("{} in={} out1={}_f.fq out2={}_r.fq minavgquality={}".format(reformat_command, file, file, file, MIN_AVERAGE_QUALITY), os.path.basename(file), STAGE_REFORMAT)
     # subprocess.call("rm {}_r.fq".format(file), shell=True)
 
+def run_fq2str(file):
     # convert fastq to plain list of seqs (for Venkat's script)
-    subprocess.call('python ./src/fq2str.py {}_f.fq'.format(file), shell=True)
+    profiler.check_call('python ./src/fq2str.py {}_f.fq'.format(file), os.path.basename(file), STAGE_FQ2STR)
     # subprocess.call("rm {}_f.fq".format(file), shell=True)
 
-def run_count_sequences(file):
+def temp_directory(file):
+    # each barcode gets its own temp directory so that several can be counted at once
+    return os.path.join(os.path.dirname(file), "temp_" + os.path.basename(file))
+
+def run_count_sequences(file, count_processes=1, npz=False):
     # run Venkat's script
     output_path = os.path.dirname(file)
-    subprocess.call('python ./src/count_sequences.py {}_f_nts_only "{}/temp" -c "{}/sequence_counts"'.format(file,output_path,output_path), shell=True)
-    subprocess.call('rm -r "{}/temp"'.format(output_path), shell=True)
+    profiler.check_call('python ./src/count_sequences.py {}_f_nts_only "{}" -c "{}/sequence_counts" -p {}{}'.format(file,temp_directory(file),output_path,count_processes," --npz" if npz else ""), os.path.basename(file), STAGE_COUNT)
+    record_count_profile(file)
+    subprocess.check_call('rm -r "{}"'.format(temp_directory(file)), shell=True)
 
+def run_streaming(file, npz=False):
+    # quality filter, de-interleave and count the fastq file in one pass
+    output_path = os.path.dirname(file)
+    profiler.check_call('python ./src/count_sequences.py {} "{}" -c "{}/sequence_counts" --fastq --min-average-quality {}{}'.format(file,temp_directory(file),output_path,MIN_AVERAGE_QUALITY," --npz" if npz else ""), os.path.basename(file), STAGE_COUNT)
+    record_count_profile(file)
+    subprocess.check_call('rm -r "{}"'.format(temp_directory(file)), shell=True)
 
-def main(parallel=False):
-    barcode_directory = str(sys.argv[1])
-    reformat_command = str(sys.argv[2])
-    print('running bbtools reformating and converting fastq to string')
-    if parallel:
-        p = multiprocessing.Pool()
-    for f in glob.glob(os.path.join(barcode_directory, "barcode*")):
+def record_count_profile(file):
+    # keep the stage profile that count_sequences.py wrote before its temp directory is removed
+    profile_path = os.path.join(temp_directory(file), fastq_stream.counts_basename(file) + "_" + profiler.PROFILE_NAME)
+    if os.path.exists(profile_path):
+        with open(profile_path) as profile_file:
+            stages = json.load(profile_file)
+        with profiler.LOCK:
+            sc.StatCollector().create(stages, profiler.STAT_PROFILE, os.path.basename(file), STAGE_COUNT, "stages")
+
+def write_profile(counts_directory):
+    # barcodes that were not processed in this run keep their profile from the last run
+    profile_path = os.path.join(counts_directory, profiler.PROFILE_NAME)
+    profile = {}
+    if os.path.exists(profile_path):
+        with open(profile_path) as profile_file:
+            profile = json.load(profile_file)
+    profile.update(profiler.summary())
+    sc.write_json(profile_path, profile)
+
+def counting_parameters():
+    # everything that changes the read count tables (besides the fastq files)
+    return {
+        "sorting_tasks": count_sequences.SORTING_TASKS,
+        "discard_threshold": count_sequences.DISCARD_THRESHOLD,
+        "min_average_quality": MIN_AVERAGE_QUALITY,
+    }
+
+def barcode_files(barcode_directory, gzipped=False):
+    # if gzipped is True, gzipped fastq files (but not .tar.gz archives) are included
+    files = []
+    for f in sorted(glob.glob(os.path.join(barcode_directory, "barcode*"))):
         # skip files ending in ".fq". Makes it easier if you rerun this script
-        if f.endswith(".gz"):
+        if f.endswith(".tar.gz"):
+            continue
+        if f.endswith(".gz") and not gzipped:
             continue
         if f.endswith("_r.fq"):
             continue
@@ -56,38 +134,88 @@ def main(parallel=False):
             continue
         if f.endswith("_nts_only"):
             continue
-        if parallel:
-            # launch a process for each file (ish).
-            # The result will be approximately one process per CPU core available.
-            p.apply_async(run, [f, reformat_command])
-        else:
-            run(f, reformat_command)
-    if parallel:
-        p.close()
-        p.join() # Wait for all child processes to close.
-
-    if parallel:
-        p = multiprocessing.Pool()
-    print("running count_sequences.py")
-    for f in glob.glob(os.path.join(barcode_directory, "barcode*")):
-        # skip files ending in ".fq". Makes it easier if you rerun this script
-        if f.endswith(".gz"):
+        if os.path.basename(f).startswith("temp_"):
             continue
-        if f.endswith("_r.fq"):
-            continue
-        if f.endswith("_f.fq"):
-            continue
-        if f.endswith("_nts_only"):
+        files.append(f)
+    return files
+
+
+def main(barcode_directory, reformat_command=None, stream=False, workers=None, count_processes=1, force=False, npz=False):
+    '''
+    Processes every barcode file in barcode_directory. Each barcode is a chain of
+    jobs (reformat -> fq2str -> count, or a single count job with stream=True)
+    and the chains run through a JobScheduler, so a barcode is counted as soon as
+    its own files are ready. workers is a dictionary of the number of jobs that
+    may run at once in each stage (1 by default). Returns the list of jobs that
+    failed or were skipped.
+
+    Barcodes that the manifest in the sequence_counts directory lists as up to
+    date are not processed again, unless force is True.
+
+    If npz is True, each read count table is also saved as a binary .npz table,
+    and a barcode whose .npz table is missing is not up to date.
+    '''
+    scheduler = JobScheduler(workers if workers is not None else {})
+    counts_directory = os.path.join(barcode_directory, "sequence_counts")
+    if not os.path.exists(counts_directory):
+        os.mkdir(counts_directory)
+    manifest = Manifest(os.path.join(counts_directory, MANIFEST_NAME))
+    parameters = counting_parameters()
+
+    for f in barcode_files(barcode_directory, gzipped=stream):
+        name = os.path.basename(f)
+        counts_files = [os.path.join(counts_directory, fastq_stream.counts_basename(f))]
+        if npz:
+            counts_files.append(counts_files[0] + count_sequences.COUNT_TABLE_EXTENSION)
+        if not force and manifest.is_current(name, [f], parameters, counts_files):
+            print("up to date: {}".format(name))
             continue
-        if parallel:
-            # launch a process for each file (ish).
-            # The result will be approximately one process per CPU core available.
-            p.apply_async(run_count_sequences, f)
+        manifest.forget(name)
+        if stream:
+            count = scheduler.add(Job("count " + name, STAGE_COUNT, run_streaming, [f, npz]))
+        else:
+            reformat = scheduler.add(Job("reformat " + name, STAGE_REFORMAT, run_reformat, [f, reformat_command]))
+            fq2str = scheduler.add(Job("fq2str " + name, STAGE_FQ2STR, run_fq2str, [f], dependencies=[reformat.name]))
+            count = scheduler.add(Job("count " + name, STAGE_COUNT, run_count_sequences, [f, count_processes, npz], dependencies=[fq2str.name]))
+        scheduler.add(Job("manifest " + name, STAGE_MANIFEST, manifest.record, [name, [f], parameters, counts_files], dependencies=[count.name]))
+
+    print("running {} jobs".format(len(scheduler.jobs)))
+    failed = scheduler.run()
+    write_profile(counts_directory)
+    for job in failed:
+        if job.name in scheduler.errors:
+            print("FAILED: {}\n{}".format(job.name, scheduler.errors[job.name]))
         else:
-            run_count_sequences(f)
-    if parallel:
-        p.close()
-        p.join() # Wait for all child processes to close.
+            print("SKIPPED: {} (a job it depends on failed)".format(job.name))
+    return failed
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='De-interleaves, quality filters and counts the reads in each barcode fastq file.')
+    parser.add_argument('barcode_directory', type=str,
+                        help='The path to the de-multiplexed fastq files (barcode_x)')
+    parser.add_argument('reformat_command', type=str, nargs='?', default=None,
+                        help='The path to the bbtools reformat.sh executable (not needed with --stream)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Count the fastq files directly, without reformat.sh, fq2str.py or intermediate files')
+    parser.add_argument('--reformat-workers', type=int, default=1,
+                        help='The number of reformat.sh jobs that may run at the same time')
+    parser.add_argument('--fq2str-workers', type=int, default=1,
+                        help='The number of fq2str.py jobs that may run at the same time')
+    parser.add_argument('--count-workers', type=int, default=1,
+                        help='The number of count_sequences.py jobs that may run at the same time')
+    parser.add_argument('--count-processes', type=int, default=1,
+                        help='The number of processes each count_sequences.py job uses (not used with --stream)')
+    parser.add_argument('--force', action='store_true',
+                        help='Process every barcode, even if the manifest says its read count table is up to date')
+    parser.add_argument('--npz', action='store_true',
+                        help='Also save each read count table as a binary .npz table for the analysis scripts')
+    args = parser.parse_args()
+    if args.reformat_command is None and not args.stream:
+        parser.error('reformat_command is required unless --stream is used')
+    workers = {
+        STAGE_REFORMAT: args.reformat_workers,
+        STAGE_FQ2STR: args.fq2str_workers,
+        STAGE_COUNT: args.count_workers,
+    }
+    failed = main(args.barcode_directory, args.reformat_command, stream=args.stream, workers=workers, count_processes=args.count_processes, force=args.force, npz=args.npz)
+    sys.exit(1 if len(failed) > 0 else 0)
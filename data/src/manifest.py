@@ -0,0 +1,145 @@
+'''
+Contains the Manifest class, which remembers what main_process_and_count_barcodes.py
+has already computed so that a rerun only processes the barcodes that changed.
+
+For each barcode the manifest (a JSON file, by default
+[barcode_directory]/sequence_counts/manifest.json) records:
+    - the SHA-1 hash of the input fastq file
+    - the parameters the reads were counted with (SORTING_TASKS,
+      DISCARD_THRESHOLD and the minimum average quality)
+    - the SHA-1 hash of each output file
+
+A barcode is up to date if its input and parameters are unchanged and all of
+its outputs still exist with the recorded hashes.
+
+Usage:
+>>> manifest = Manifest("fastq_files/sequence_counts/manifest.json")
+>>> if not manifest.is_current("barcode_0", ["fastq_files/barcode_0"], parameters):
+...     # process barcode_0
+...     manifest.record("barcode_0", ["fastq_files/barcode_0"], parameters, ["fastq_files/sequence_counts/barcode_0_f_nts_only"])
+
+Hashing large fastq files takes a while, so the size and modification time of
+every file is recorded too, and a file whose size and modification time have not
+changed is not hashed again.
+'''
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_NAME = "manifest.json"
+HASH_BLOCK_SIZE = 1 << 20
+
+def file_hash(path):
+    '''
+    Returns the SHA-1 hash of the file at path as a hex string.
+    '''
+    sha = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha.update(block)
+    return sha.hexdigest()
+
+def normalize(value):
+    '''
+    Returns value as it reads back from JSON (tuples become lists), so that it
+    can be compared to the values in a loaded manifest.
+    '''
+    return json.loads(json.dumps(value))
+
+class Manifest(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Hashes computed during this run, by (path, size, modification time)
+        self.hashes = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.barcodes = json.load(file)
+        else:
+            self.barcodes = {}
+
+    def _describe_file(self, path, previous=None):
+        '''
+        Returns a dictionary with the size, modification time and hash of the
+        file at path, or None if it does not exist. If previous describes the
+        same size and modification time, its hash is reused.
+        '''
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        description = {"size": stat.st_size, "mtime": stat.st_mtime}
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if previous is not None and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime:
+            description["sha1"] = previous["sha1"]
+        else:
+            if key not in self.hashes:
+                self.hashes[key] = file_hash(path)
+            description["sha1"] = self.hashes[key]
+        return description
+
+    def _key(self, path):
+        # Files are stored relative to the manifest, so the directory can be moved
+        return os.path.relpath(path, os.path.dirname(os.path.abspath(self.path)))
+
+    def _files_match(self, paths, recorded):
+        if sorted(self._key(path) for path in paths) != sorted(recorded.keys()):
+            return False
+        for path in paths:
+            previous = recorded[self._key(path)]
+            description = self._describe_file(path, previous)
+            if description is None or description["sha1"] != previous["sha1"]:
+                return False
+        return True
+
+    def is_current(self, name, inputs, parameters, outputs=None):
+        '''
+        Returns True if the barcode called name was last processed from the same
+        input files with the same parameters, and its recorded output files (or
+        the given outputs, if not None) are unchanged.
+        '''
+        entry = self.barcodes.get(name)
+        if entry is None or entry["parameters"] != normalize(parameters):
+            return False
+        if outputs is None:
+            outputs = [os.path.join(os.path.dirname(os.path.abspath(self.path)), key) for key in entry["outputs"]]
+        return self._files_match(inputs, entry["inputs"]) and self._files_match(outputs, entry["outputs"])
+
+    def record(self, name, inputs, parameters, outputs):
+        '''
+        Records that the barcode called name was processed from the given input
+        files with the given parameters and produced the given output files, and
+        saves the manifest.
+        '''
+        previous = self.barcodes.get(name, {})
+        entry = {"parameters": normalize(parameters), "inputs": {}, "outputs": {}}
+        for kind, paths in (("inputs", inputs), ("outputs", outputs)):
+            for path in paths:
+                description = self._describe_file(path, previous.get(kind, {}).get(self._key(path)))
+                assert description is not None, "Missing file {} of barcode {}".format(path, name)
+                entry[kind][self._key(path)] = description
+        with self.lock:
+            self.barcodes[name] = entry
+            self.save()
+
+    def forget(self, name):
+        '''
+        Removes the barcode called name from the manifest, so it is processed on
+        the next run.
+        '''
+        with self.lock:
+            if name in self.barcodes:
+                del self.barcodes[name]
+                self.save()
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run can't leave a
+        # truncated manifest behind
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.barcodes, file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.path)
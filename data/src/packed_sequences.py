@@ -0,0 +1,133 @@
+'''
+Contains the SequencePacker class, which encodes sequences of a fixed length as
+64-bit integers (2 bits per base), and the PackedCounter class, which counts
+sequences encoded this way with array operations instead of a dictionary.
+
+A sequence of up to MAX_PACKED_LENGTH A/C/G/T bases is packed into the low bits
+of a uint64, first base in the highest bits, with A=0, C=1, G=2 and T=3, so
+sorting the codes sorts the sequences alphabetically. Sequences that can't be
+packed (because they contain N or any other character, or have a different
+length) take an escape path: they are numbered in the order they are first seen
+and their code is ESCAPE_BIT | number.
+
+Usage:
+>>> packer = SequencePacker(31)
+>>> codes = packer.pack(matrix)       # uint8 array, one row per sequence
+>>> packer.unpack(codes)              # list of strings
+>>> counter = PackedCounter(packer)
+>>> counter.add(matrix, line_indexes)
+>>> counter.items()                   # [(sequence, count)] in order of first occurrence
+'''
+import numpy as np
+
+MAX_PACKED_LENGTH = 31
+ESCAPE_BIT = np.uint64(1 << 63)
+BASE_LETTERS = np.array([ord(c) for c in 'ACGT'], dtype=np.uint8)
+
+# 2-bit value of each byte, or NOT_A_BASE for bytes that are not A/C/G/T
+NOT_A_BASE = 255
+BASE_VALUES = np.full(256, NOT_A_BASE, dtype=np.uint8)
+for value, letter in enumerate(BASE_LETTERS):
+    BASE_VALUES[letter] = value
+
+class SequencePacker(object):
+
+    def __init__(self, length):
+        assert length <= MAX_PACKED_LENGTH, "Sequences longer than {} bases can't be packed".format(MAX_PACKED_LENGTH)
+        self.length = length
+        # Sequences that can't be packed, by escape number and the reverse
+        self.escapes = []
+        self.escape_numbers = {}
+
+    def escape(self, sequence):
+        '''
+        Returns the escape code of a sequence that can't be packed.
+        '''
+        if sequence not in self.escape_numbers:
+            self.escape_numbers[sequence] = len(self.escapes)
+            self.escapes.append(sequence)
+        return ESCAPE_BIT | np.uint64(self.escape_numbers[sequence])
+
+    def pack(self, matrix):
+        '''
+        Returns a uint64 array with the code of each row of matrix, a uint8 array
+        of shape (number of sequences, length) holding the bytes of the sequences.
+        '''
+        values = BASE_VALUES[matrix]
+        codes = np.zeros(len(matrix), dtype=np.uint64)
+        if matrix.shape[1] != self.length:
+            escaped = np.arange(len(matrix))
+        else:
+            for column in values.T:
+                codes <<= np.uint64(2)
+                codes |= column
+            escaped = np.flatnonzero((values == NOT_A_BASE).any(axis=1))
+        for row in escaped.tolist():
+            codes[row] = self.escape(matrix[row].tostring())
+        return codes
+
+    def unpack(self, codes):
+        '''
+        Returns the list of sequences for a uint64 array of codes.
+        '''
+        escaped = (codes & ESCAPE_BIT) != 0
+        values = np.empty((len(codes), self.length), dtype=np.uint8)
+        remaining = codes.copy()
+        for i in xrange(self.length - 1, -1, -1):
+            values[:, i] = remaining & np.uint64(3)
+            remaining >>= np.uint64(2)
+        letters = BASE_LETTERS[values]
+        sequences = letters.view('S{}'.format(self.length)).ravel().tolist() if self.length > 0 else [''] * len(codes)
+        for i in np.flatnonzero(escaped).tolist():
+            sequences[i] = self.escapes[int(codes[i] & ~ESCAPE_BIT)]
+        return sequences
+
+class PackedCounter(object):
+    '''
+    Counts packed sequences. The codes seen so far are kept sorted, with the
+    number of times and the line index at which each was first seen, so that the
+    sequences can be listed in order of first occurrence like the keys of a
+    dictionary that was filled line by line.
+    '''
+
+    def __init__(self, packer):
+        self.packer = packer
+        self.codes = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.first_indexes = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def add(self, matrix, indexes):
+        '''
+        Counts the sequences in the rows of matrix (see SequencePacker.pack),
+        which are at the given line indexes. Batches must be added in the order
+        of their line indexes.
+        '''
+        if len(matrix) == 0:
+            return
+        codes, first, counts = np.unique(self.packer.pack(matrix), return_index=True, return_counts=True)
+        first_indexes = np.asarray(indexes, dtype=np.int64)[first]
+
+        positions = np.searchsorted(self.codes, codes)
+        found = positions < len(self.codes)
+        found[found] = self.codes[positions[found]] == codes[found]
+        # Codes that were already seen keep their first index
+        self.counts[positions[found]] += counts[found]
+
+        new = ~found
+        if new.any():
+            all_codes = np.concatenate([self.codes, codes[new]])
+            order = np.argsort(all_codes, kind='mergesort')
+            self.codes = all_codes[order]
+            self.counts = np.concatenate([self.counts, counts[new]])[order]
+            self.first_indexes = np.concatenate([self.first_indexes, first_indexes[new]])[order]
+
+    def items(self):
+        '''
+        Returns a list of (sequence, count) for every sequence counted, in order
+        of first occurrence.
+        '''
+        order = np.argsort(self.first_indexes, kind='mergesort')
+        return zip(self.packer.unpack(self.codes[order]), self.counts[order].tolist())
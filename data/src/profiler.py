@@ -0,0 +1,138 @@
+'''
+Records how long each stage of a run takes, how many reads it handles and
+discards, and the peak memory use, in the stat collector (under STAT_PROFILE),
+and writes them to a JSON file.
+
+count_sequences.py times its reading, alignment, counting and writing stages and
+writes [output]/[input name]_profile.json next to its stats directory.
+main_process_and_count_barcodes.py times the reformat, fq2str and count jobs of
+every barcode, and collects them (with the profile of each count_sequences.py
+run) in [barcode_directory]/sequence_counts/profile.json.
+
+Usage:
+>>> ALIGNMENT = Stage("alignment")
+>>> with ALIGNMENT:
+...     generics = align(reads)
+>>> ALIGNMENT.reads.add(len(reads))
+>>> ALIGNMENT.discarded.add(generics.count(None))
+>>> write_json("output/profile.json")
+
+A stage can also run the Python profiler (cProfile) whenever it is entered:
+>>> ALIGNMENT.enable_cprofile()
+>>> ALIGNMENT.write_cprofile("alignment.prof")
+
+The seconds of a stage are added up over every time it is entered (and over all
+processes whose statistics are merged), and the peak memory use is the largest
+resident set size of the process and its finished children, in kilobytes.
+'''
+import cProfile
+import os
+import resource
+import subprocess
+import threading
+import time
+
+import stat_collector as sc
+
+STAT_PROFILE = "profile"
+PROFILE_NAME = "profile.json"
+
+# Statistics are recorded from the job threads of the barcode driver
+LOCK = threading.Lock()
+
+def peak_rss():
+    '''
+    Returns the peak resident set size in kilobytes of this process or of any of
+    its finished child processes, whichever is larger.
+    '''
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+class Stage(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.timer = sc.timer(STAT_PROFILE, name, "seconds")
+        self.reads = sc.counter_handle(STAT_PROFILE, name, "reads")
+        self.discarded = sc.counter_handle(STAT_PROFILE, name, "discarded")
+        self.cprofile = None
+
+    def __enter__(self):
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        self.timer.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.__exit__(*exc_info)
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        sc.maximum(peak_rss(), STAT_PROFILE, self.name, "peak_rss_kb")
+
+    def iterate(self, iterable):
+        '''
+        Yields the items of iterable, adding the time it takes to produce each
+        one to the stage.
+        '''
+        iterator = iter(iterable)
+        while True:
+            with self:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def enable_cprofile(self):
+        '''
+        Runs cProfile whenever the stage is entered.
+        '''
+        self.cprofile = cProfile.Profile()
+
+    def write_cprofile(self, path):
+        '''
+        Writes the cProfile statistics of the stage (if enabled) to path, to be
+        read with the pstats module.
+        '''
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(path)
+
+def check_call(command, *path):
+    '''
+    Runs a shell command like subprocess.check_call, and records its wall time
+    and peak resident set size (including the processes it starts) at the given
+    key path under STAT_PROFILE.
+    '''
+    start = time.time()
+    process = subprocess.Popen(command, shell=True)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    with LOCK:
+        sc.timer(*((STAT_PROFILE,) + path + ("seconds",))).add(time.time() - start)
+        sc.maximum(usage.ru_maxrss, *((STAT_PROFILE,) + path + ("peak_rss_kb",)))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+def summary(profile=None):
+    '''
+    Returns the profile statistics (by default, those in the stat collector)
+    with the reads per second of each stage that counted its reads.
+    '''
+    if profile is None:
+        profile = sc.StatCollector().get(STAT_PROFILE) or {}
+    result = {}
+    for key, value in profile.items():
+        if type(value) is not dict:
+            result[key] = value
+            continue
+        result[key] = summary(value)
+        if "reads" in value and value.get("seconds", 0) > 0:
+            result[key]["reads_per_second"] = value["reads"] / value["seconds"]
+    return result
+
+def write_json(out_path, profile=None):
+    '''
+    Writes the profile statistics, with the reads per second of each stage, to
+    a JSON file.
+    '''
+    sc.write_json(out_path, summary(profile))
@@ -0,0 +1,68 @@
+'''
+Contains the LRUCache class, a bounded least-recently-used cache. count_sequences
+uses it to remember the generic sequence (and alignment score) of the reads it
+has already aligned, since sequencing libraries contain the same read many times.
+
+Usage:
+>>> cache = LRUCache(100000)
+>>> cache.put(read, (generic, score))
+>>> cache.get(read)
+
+The number of hits, misses and evictions can be added to the stat collector:
+>>> cache.report("cache")
+'''
+from collections import OrderedDict
+
+import stat_collector as sc
+
+class LRUCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        '''
+        Returns the value stored for key and marks it as the most recently used
+        item, or returns None (and counts a miss) if key is not in the cache.
+        '''
+        if key not in self.items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        value = self.items.pop(key)
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores value for key, evicting the least recently used items if the cache
+        grows beyond max_size.
+        '''
+        if self.max_size <= 0:
+            return
+        if key in self.items:
+            del self.items[key]
+        self.items[key] = value
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def report(self, *path):
+        '''
+        Adds the hits, misses and evictions since the last report to the stat
+        collector under the given key path.
+        '''
+        sc.counter(self.hits, *(list(path) + ["hits"]))
+        sc.counter(self.misses, *(list(path) + ["misses"]))
+        sc.counter(self.evictions, *(list(path) + ["evictions"]))
+        self.hits = self.misses = self.evictions = 0
@@ -14,11 +14,31 @@ To keep a count of unique objects:
 To increment some or all of a list of keys:
 >>> sc.apply_counter(range(5), lambda x: 1 if my_value < x else 0, "my_stat_group")
 
+In hot loops, get a handle once and increment it, which skips the key path lookup:
+>>> reads = sc.counter_handle("my_stat_group", "reads")
+>>> reads.add(1)
+>>> scores = sc.histogram("my_stat_group", "scores")
+>>> scores.add(score)
+
+To add up the time spent in a block of code:
+>>> with sc.timer("my_stat_group", "seconds"):
+...     do_work()
+
+To keep the largest value seen (such as a peak memory use):
+>>> sc.maximum(value, "my_stat_group", "peak")
+
+To send the statistics of a worker process back to the parent process:
+>>> statistics = sc.snapshot()       # in the worker
+>>> sc.merge(statistics)             # in the parent
+
 To write the statistics to a directory, where each file name is prefixed by
 'my_program':
 >>> sc.write("/my/path/to/output/stats", prefix="my_program")
 '''
+import copy
+import json
 import os
+import time
 
 def singleton(cls):
     instances = {}
@@ -34,6 +54,8 @@ class StatCollector(object):
     def __init__(self):
         self.statistics = {}
         self.separator = ','
+        # Incremented by reset(), so that handles know to look up their key path again
+        self.generation = 0
 
     def __str__(self):
         return str(self.statistics)
@@ -68,6 +90,20 @@ class StatCollector(object):
             current_item = current_item[key]
         current_item[path[-1]] = item
 
+    def dictionary(self, *path):
+        '''
+        Returns the dictionary at the given key path, creating as many
+        dictionaries as necessary.
+        '''
+        current_item = self.statistics
+        for key in path:
+            assert type(current_item) is dict, "The key path leads to a premature non-dictionary type: {}".format("->".join(path))
+            if key not in current_item:
+                current_item[key] = {}
+            current_item = current_item[key]
+        assert type(current_item) is dict, "The key path does not lead to a dictionary: {}".format("->".join(path))
+        return current_item
+
     def set(self, item, *path):
         '''
         Puts the given item at the given key path. Raises an assertion if the
@@ -109,6 +145,106 @@ def counter(amount, *path):
     collector = StatCollector()
     collector.create_or_set(lambda old: (old if old is not None else 0) + int(amount), *path)
 
+class _Handle(object):
+    '''
+    Base class of the pre-bound handles. The dictionary that holds the statistic
+    is looked up once, and again only after the stat collector is reset.
+    '''
+
+    def __init__(self, path):
+        assert len(path) > 0, "Cannot bind a handle to the root key path"
+        self.path = path
+        self.generation = None
+        self.container = None
+
+    def _container(self, path):
+        collector = StatCollector()
+        if self.generation != collector.generation:
+            self.container = collector.dictionary(*path)
+            self.generation = collector.generation
+        return self.container
+
+class CounterHandle(_Handle):
+
+    def add(self, amount=1):
+        '''
+        Increments the statistic at the handle's key path by amount.
+        '''
+        container = self._container(self.path[:-1])
+        key = self.path[-1]
+        container[key] = container.get(key, 0) + int(amount)
+
+class Histogram(_Handle):
+
+    def add(self, key, amount=1):
+        '''
+        Increments the count of key in the histogram by amount.
+        '''
+        container = self._container(self.path)
+        container[key] = container.get(key, 0) + int(amount)
+
+    def update(self, counts):
+        '''
+        Adds a dictionary of counts by key to the histogram.
+        '''
+        container = self._container(self.path)
+        for key, amount in counts.items():
+            container[key] = container.get(key, 0) + int(amount)
+
+class Timer(_Handle):
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.add(time.time() - self.start)
+
+    def add(self, seconds):
+        '''
+        Adds seconds to the statistic at the timer's key path.
+        '''
+        container = self._container(self.path[:-1])
+        key = self.path[-1]
+        container[key] = container.get(key, 0.0) + seconds
+
+class Maximum(int):
+    '''
+    An integer statistic that keeps the largest value it was given, even when
+    statistics are merged.
+    '''
+    pass
+
+def counter_handle(*path):
+    '''
+    Returns a handle whose add(amount) method increments the statistic at the
+    given key path, like counter(amount, *path) but without looking up the key
+    path on every call.
+    '''
+    return CounterHandle(path)
+
+def histogram(*path):
+    '''
+    Returns a handle whose add(key, amount) method increments the statistic at
+    the key path path + (key,), like counter(amount, *(path + (key,))).
+    '''
+    return Histogram(path)
+
+def timer(*path):
+    '''
+    Returns a context manager that adds the number of seconds spent inside it
+    to the statistic at the given key path.
+    '''
+    return Timer(path)
+
+def maximum(amount, *path):
+    '''
+    Sets the statistic at the given key path to amount if it is larger than the
+    current value.
+    '''
+    collector = StatCollector()
+    collector.create_or_set(lambda old: Maximum(max(old, amount) if old is not None else amount), *path)
+
 def apply_counter(child_keys, amount_function, *path):
     '''
     For each key in child_keys, adds the amount given by amount_function to the
@@ -155,7 +291,7 @@ def fraction(amount, total_amount, *path):
     if old_value is None:
         collector.create([int(amount), int(total_amount)], *path)
     else:
-        assert old_value is list and len(old_value) == 2, "Key path {} cannot be used as a fraction with current value {}".format("->".join(path), old_value)
+        assert type(old_value) is list and len(old_value) == 2, "Key path {} cannot be used as a fraction with current value {}".format("->".join(path), old_value)
         collector.set([old_value[0] + int(amount), old_value[1] + int(total_amount)], *path)
 
 def _is_iterable(item):
@@ -196,11 +332,65 @@ def write(out_dir, prefix="", statistics=None):
         for key in sorted(statistics.keys()):
             write(out_dir, prefix + "_" + _format_item(key), statistics[key])
 
+def _json_item(value):
+    if type(value) is dict:
+        return dict((key if isinstance(key, basestring) else _format_item(key), _json_item(item)) for key, item in value.items())
+    elif type(value) is set:
+        return len(value)
+    elif isinstance(value, Maximum):
+        return int(value)
+    return value
+
+def write_json(out_path, statistics=None):
+    '''
+    Writes the stat collector's dictionary (or the given statistics) to a single
+    JSON file. Keys are written as strings and unique counters as their counts.
+    '''
+    if statistics is None:
+        statistics = StatCollector().statistics
+    with open(out_path, "w") as file:
+        json.dump(_json_item(statistics), file, indent=2, sort_keys=True)
+
 def reset():
     '''
     Resets the stat collector.
     '''
-    StatCollector().statistics = {}
+    collector = StatCollector()
+    collector.statistics = {}
+    collector.generation += 1
+
+def snapshot():
+    '''
+    Returns a copy of the statistics collected so far, which can be pickled and
+    passed to merge() in another process.
+    '''
+    return copy.deepcopy(StatCollector().statistics)
+
+def _merge_into(statistics, other, path):
+    for key, value in other.items():
+        if key not in statistics:
+            statistics[key] = copy.deepcopy(value)
+        elif type(value) is dict:
+            _merge_into(statistics[key], value, path + [key])
+        elif type(value) is set:
+            statistics[key] = statistics[key] | value
+        elif isinstance(value, Maximum):
+            statistics[key] = Maximum(max(statistics[key], value))
+        elif type(value) is list:
+            # fractions
+            statistics[key] = [x + y for x, y in zip(statistics[key], value)]
+        else:
+            assert not _is_iterable(value), "Cannot merge the statistic at {}".format("->".join(str(x) for x in path + [key]))
+            statistics[key] = statistics[key] + value
+
+def merge(statistics):
+    '''
+    Adds statistics (as returned by snapshot(), usually in another process) to
+    the stat collector. Counters and fractions are added, and the items seen by
+    unique counters are combined, so merging the snapshots of several workers
+    gives the same statistics as collecting them all in one process.
+    '''
+    _merge_into(StatCollector().statistics, statistics, [])
 
 def write_input_parameters(params, out_path):
     '''
@@ -0,0 +1,230 @@
+'''
+Contains the TemplateMatcher class, which places an alignment template (see
+SORTING_TASKS in count_sequences.py) on a whole batch of reads at once.
+
+TemplateMatcher gives the same offsets and scores as
+
+    Aligner(different_score=0).align(read, template, min_overlap=len(template))
+
+which is how get_generic_sequence_by_alignment aligns a single read. With those
+settings the template must lie completely inside the read, so the allowed
+offsets are 0 to len(read) - len(template), and the score is just the number of
+template bases that are identical to the read. Ties go to the smallest offset
+and a read that is shorter than the template gets (0, NO_SCORE).
+
+Instead of trying one offset at a time in Python, the reads are loaded into a
+uint8 matrix (one row per read, padded with zero bytes) and every read is scored
+at every offset with one array comparison per fixed base in the template.
+
+Single reads are aligned with an anchor index instead. The fixed bases of the
+template form anchors (for example CCT, GAA and CCGG in
+*********CCT***GAA*********CCGG). A read that is not discarded has at most
+discard_threshold mismatched template bases, so if there are more anchors than
+that, at least one anchor is intact at the best offset. Only the offsets where
+str.find locates an anchor then need to be scored, and every offset is scored
+only for reads where none of those candidates is good enough to be kept. For
+batches, the vectorized scan is faster than looking up anchors read by read.
+'''
+
+import numpy as np
+
+from aligner import GENERIC_SEQUENCE_TOKEN, VARIABLE_REGION_TOKEN, NON_SCORED_TOKENS, NO_SCORE
+
+PAD_BYTE = '\0'
+
+class TemplateMatcher(object):
+
+    def __init__(self, template, output_template, discard_threshold):
+        self.template = template
+        self.output_template = output_template
+        self.discard_threshold = discard_threshold
+
+        # Positions in the template that are scored. Tokens never match a base in
+        # a read, so they can be left out of the comparison entirely.
+        self.fixed_positions = [i for i, c in enumerate(template) if c not in NON_SCORED_TOKENS]
+        self.fixed_bases = [np.uint8(ord(template[i])) for i in self.fixed_positions]
+        self.num_matching_bases = len(self.fixed_positions)
+
+        # Runs of consecutive fixed bases, as (position in template, bases)
+        self.anchors = []
+        for position in self.fixed_positions:
+            if len(self.anchors) > 0 and self.anchors[-1][0] + len(self.anchors[-1][1]) == position:
+                self.anchors[-1][1] += template[position]
+            else:
+                self.anchors.append([position, template[position]])
+        self.anchors = [tuple(anchor) for anchor in self.anchors]
+        self.anchored = discard_threshold < len(self.anchors)
+
+        # The generic sequence runs from the first to the last VARIABLE_REGION_TOKEN
+        # in the output template, with GENERIC_SEQUENCE_TOKEN for the positions in
+        # between that are not variable.
+        variable_positions = [i for i, c in enumerate(output_template) if c == VARIABLE_REGION_TOKEN]
+        if len(variable_positions) > 0:
+            self.output_start = variable_positions[0]
+            self.output_end = variable_positions[-1] + 1
+        else:
+            self.output_start = self.output_end = 0
+        self.output_mask = [c == VARIABLE_REGION_TOKEN for c in output_template[self.output_start:self.output_end]]
+        self.output_is_contiguous = all(self.output_mask)
+
+    def read_matrix(self, reads):
+        '''
+        Returns (matrix, lengths) where matrix is a uint8 array with one row per
+        read, padded on the right with PAD_BYTE, and lengths is the length of
+        each read.
+        '''
+        lengths = np.array([len(read) for read in reads], dtype=np.int64)
+        width = int(lengths.max()) if len(reads) > 0 else 0
+        if width == 0:
+            return np.zeros((len(reads), 0), dtype=np.uint8), lengths
+        if (lengths == width).all():
+            joined = ''.join(reads)
+        else:
+            joined = ''.join([read.ljust(width, PAD_BYTE) for read in reads])
+        matrix = np.frombuffer(joined, dtype=np.uint8).reshape(len(reads), width)
+        return matrix, lengths
+
+    def score_matrix(self, matrix, lengths):
+        '''
+        Returns an array of shape (number of reads, number of offsets) holding
+        the score of each read at each offset. Offsets where the template does
+        not fit inside the read are given a score of -1.
+        '''
+        num_offsets = matrix.shape[1] - len(self.template) + 1
+        if num_offsets <= 0:
+            return np.zeros((matrix.shape[0], 0), dtype=np.int32)
+        scores = np.zeros((matrix.shape[0], num_offsets), dtype=np.int32)
+        for position, base in zip(self.fixed_positions, self.fixed_bases):
+            scores += matrix[:, position:position + num_offsets] == base
+        last_offsets = lengths - len(self.template)
+        scores[np.arange(num_offsets)[np.newaxis, :] > last_offsets[:, np.newaxis]] = -1
+        return scores
+
+    def align_arrays(self, matrix, lengths):
+        '''
+        Aligns the template to every row of a matrix returned by read_matrix, and
+        returns (offsets, scores, alignable) as arrays. Reads that are shorter
+        than the template are not alignable, and their offset and score are 0.
+        '''
+        scores = self.score_matrix(matrix, lengths)
+        alignable = lengths >= len(self.template)
+        if scores.shape[1] == 0:
+            zeros = np.zeros(len(lengths), dtype=np.int64)
+            return zeros, zeros, alignable
+
+        # argmax returns the first maximum, which is the smallest offset as in
+        # Aligner.align
+        best_offsets = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(lengths)), best_offsets]
+        return np.where(alignable, best_offsets, 0), np.where(alignable, best_scores, 0), alignable
+
+    def align_batch(self, reads):
+        '''
+        Aligns the template to every read in reads, and returns (offsets, scores)
+        as two lists with one entry per read.
+        '''
+        if len(reads) == 0:
+            return [], []
+        matrix, lengths = self.read_matrix(reads)
+        offsets, scores, alignable = self.align_arrays(matrix, lengths)
+        scores = [score if ok else NO_SCORE for score, ok in zip(scores.tolist(), alignable.tolist())]
+        return offsets.tolist(), scores
+
+    def extract_matrix(self, matrix, rows, offsets):
+        '''
+        Returns a uint8 array with the generic sequence of the given rows of a
+        read matrix, whose alignments start at the given offsets. Only for output
+        templates where output_is_contiguous is True.
+        '''
+        rows = np.asarray(rows)
+        generics = np.empty((len(rows), self.output_end - self.output_start), dtype=np.uint8)
+        # There are only a few distinct offsets, so copy the rows with the same
+        # offset as one slice instead of building an index for every base
+        for offset in np.unique(offsets).tolist():
+            same = offsets == offset
+            generics[same] = matrix[rows[same], offset + self.output_start:offset + self.output_end]
+        return generics
+
+    def is_discarded(self, score):
+        '''
+        Returns True if a read aligned with the given score should be discarded.
+        '''
+        return score < self.num_matching_bases - self.discard_threshold
+
+    def extract(self, read, offset):
+        '''
+        Returns the generic sequence for a read whose alignment starts at offset.
+        '''
+        segment = read[offset + self.output_start:offset + self.output_end]
+        if self.output_is_contiguous:
+            return segment
+        return ''.join([base if keep else GENERIC_SEQUENCE_TOKEN for base, keep in zip(segment, self.output_mask)])
+
+    def candidate_offsets(self, read):
+        '''
+        Returns the sorted list of offsets at which at least one anchor of the
+        template is found intact in read.
+        '''
+        last_offset = len(read) - len(self.template)
+        candidates = set()
+        for anchor_start, anchor in self.anchors:
+            position = read.find(anchor, anchor_start)
+            while position != -1 and position - anchor_start <= last_offset:
+                candidates.add(position - anchor_start)
+                position = read.find(anchor, position + 1)
+        return sorted(candidates)
+
+    def score(self, read, offset):
+        '''
+        Returns the number of fixed template bases that are identical to read
+        when the template starts at offset.
+        '''
+        return sum([1 for position in self.fixed_positions if read[offset + position] == self.template[position]])
+
+    def align(self, read):
+        '''
+        Aligns the template to a single read and returns (offset, score).
+        '''
+        last_offset = len(read) - len(self.template)
+        if last_offset < 0:
+            return 0, NO_SCORE
+
+        best_offset = 0
+        best_score = -1
+        if self.anchored:
+            for offset in self.candidate_offsets(read):
+                score = self.score(read, offset)
+                if score > best_score:
+                    best_offset, best_score = offset, score
+            if not self.is_discarded(best_score):
+                return best_offset, best_score
+
+        # No candidate is good enough, so the best score (which is still needed
+        # for the stats) could be at any offset
+        best_score = -1
+        for offset in xrange(last_offset + 1):
+            score = self.score(read, offset)
+            if score > best_score:
+                best_offset, best_score = offset, score
+        return best_offset, best_score
+
+    def generic_sequence(self, read):
+        '''
+        Returns (generic, score) for a single read, where generic is None if the
+        read is discarded.
+        '''
+        offset, score = self.align(read)
+        if self.is_discarded(score):
+            return None, score
+        return self.extract(read, offset), score
+
+    def generic_sequences(self, reads):
+        '''
+        Returns (generics, scores), where generics holds the generic sequence of
+        each read (or None if the read is discarded) and scores holds the
+        alignment score of each read.
+        '''
+        offsets, scores = self.align_batch(reads)
+        generics = [None if self.is_discarded(score) else self.extract(read, offset)
+                    for read, offset, score in zip(reads, offsets, scores)]
+        return generics, scores